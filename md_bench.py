@@ -0,0 +1,246 @@
+# Math Dice Benchmarks
+# Reproducible timings of the hot paths, as JSON to compare across commits
+# Skye Rhomberg
+
+import os
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+import itertools as it
+import md_parser as mp
+import md_humanizer as mh
+import md_solver as ms
+import md_db as db
+
+#########################################################################################
+# Configurations
+# Fixed workloads: the repeated-digit worst cases (11111, 66666: few orderings, huge
+# unary trees), a mostly-repeated combo (11116), and all-distinct combos (12345, 12346)
+
+# Enumeration and evaluation: (white dice, n_unary), first enum_limit expressions of each
+enum_configs = [((1,1,1,1,1),2),((1,1,1,1,6),1),((1,2,3,4,5),0)]
+enum_limit = 200000
+# Fraction of enum_limit timed in quick mode
+quick_fraction = 4
+# Generation: (white dice, highest n_unary), timed at every level up to it
+gen_configs = [((1,1,1,1,1),3),((6,6,6,6,6),3),((1,1,1,1,6),1),((1,2,3,4,5),0)]
+# Highest n_unary generated in quick mode
+quick_unary = 1
+# Humanizing and infix: every solution of (white dice, n_unary)
+humanize_config = ((1,2,3,4,6),0)
+# Lookups: (white dice, black total), from a db of these combos at n_unary 0
+lookup_configs = [((1,2,3,4,6),24),((1,1,1,1,6),66),((1,1,1,1,1),11)]
+# Timed runs per warm measurement, best kept
+repeat = 3
+
+#########################################################################################
+# Benchmarks
+# Each returns {name:{'seconds':..., 'count':..., 'rate':...}}, count and rate if
+# the benchmark does a number of items
+
+def bench_enumerate(quick=False):
+    '''
+    gen_valid_exprs enumeration rate
+    '''
+    res,limit = {},enum_limit//(quick_fraction if quick else 1)
+    for w_dice,n_unary in enum_configs:
+        gen = lambda: sum([1 for e in it.islice(ms.gen_valid_exprs(w_dice,n_unary),limit)])
+        res[f'enumerate/{_name(w_dice,n_unary)}'] = _timed(gen)
+    return res
+
+def bench_evaluate(quick=False):
+    '''
+    stack_calc throughput, float and exact, and the batch evaluator
+    '''
+    res,limit = {},enum_limit//(quick_fraction if quick else 1)
+    for w_dice,n_unary in enum_configs:
+        exprs = list(it.islice(ms.gen_valid_exprs(w_dice,n_unary),limit))
+        codes = [mp.to_codes(e) for e in exprs]
+        name = _name(w_dice,n_unary)
+        res[f'stack_calc/{name}'] = _timed(lambda: _calc_all(exprs,False),len(exprs))
+        res[f'stack_calc_exact/{name}'] = _timed(lambda: _calc_all(exprs,True),len(exprs))
+        res[f'evaluate_many/{name}'] = _timed(lambda: mp.evaluate_many(codes),len(exprs))
+    return res
+
+def bench_generate(quick=False):
+    '''
+    gen_valid_solutions per combo, at each unary level
+    '''
+    res = {}
+    for w_dice,max_unary in gen_configs:
+        for n_unary in range(min(max_unary,quick_unary if quick else max_unary)+1):
+            gen = lambda: sum(map(len,ms.gen_valid_solutions(w_dice,None,n_unary).values()))
+            res[f'generate/{_name(w_dice,n_unary)}'] = _timed(gen,runs=1)
+    return res
+
+def bench_humanize(quick=False):
+    '''
+    humanize on a large solution list, with cold and warm normalizing caches
+    '''
+    sols,name = _humanize_sols(humanize_config),_name(*humanize_config)
+    return {f'humanize_cold/{name}':_timed(lambda: mh.humanize(sols),len(sols),cold=True),\
+            f'humanize_warm/{name}':_timed(lambda: mh.humanize(sols),len(sols))}
+
+def bench_infix(quick=False):
+    '''
+    to_infix in each parenthesizing mode, with cold and warm node caches
+    '''
+    exprs = [e for e,sc in _humanize_sols(humanize_config)]
+    name,res = _name(*humanize_config),{}
+    for mode in ['smart','normal','full']:
+        infix = lambda: [mp.to_infix(e,mode) for e in exprs]
+        res[f'to_infix_{mode}_cold/{name}'] = _timed(infix,len(exprs),cold=True)
+        res[f'to_infix_{mode}_warm/{name}'] = _timed(infix,len(exprs))
+    return res
+
+def bench_lookup(quick=False):
+    '''
+    get_sols and solve (get_humanized) latency, cold and warm, from a legacy directory,
+    a single-file store, and live solving without a db
+    '''
+    res = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        sols,store = os.path.join(tmp,'sols'),os.path.join(tmp,'sols.mdb')
+        ms.make_sols_db(sols,{w:[b] for w,b in lookup_configs},0)
+        db.pack_db(sols,store)
+        for kind,db_name in [('dir',sols),('store',store),('live',os.path.join(tmp,'none'))]:
+            for w_dice,b_dice in lookup_configs:
+                name = f'{kind}_{ms._w_str(w_dice)}_{b_dice}'
+                for f in ['get_sols','get_humanized']:
+                    q = lambda: len(getattr(ms,f)(w_dice,b_dice,db_name))
+                    res[f'{f}_cold/{name}'] = _timed(q,cold=True)
+                    res[f'{f}_warm/{name}'] = _timed(q)
+    return res
+
+benchmarks = {'enumerate':bench_enumerate,'evaluate':bench_evaluate,\
+        'generate':bench_generate,'humanize':bench_humanize,'infix':bench_infix,\
+        'lookup':bench_lookup}
+
+def _humanize_sols(config,_sols={}):
+    '''
+    Every solution of a (white dice, n_unary) config, generated once per run
+    '''
+    if config not in _sols:
+        _sols[config] = sum(ms.gen_valid_solutions(config[0],None,config[1]).values(),[])
+    return _sols[config]
+
+def _calc_all(exprs,exact):
+    '''
+    stack_calc every expression, counting those that fail
+    '''
+    bad = 0
+    for e in exprs:
+        try:
+            mp.stack_calc(e,exact=exact)
+        except (AssertionError,)+mp.calc_errors:
+            bad += 1
+    return bad
+
+def _timed(f,count=None,cold=False,runs=None):
+    '''
+    Time a benchmark body
+    Input:
+    f: function. body, returns the number of items done if count isn't given
+    count: int. number of items done
+    cold: bool. if true, every cache is cleared before the (single) run
+    runs: int. number of runs, best kept. If none, 1 if cold else repeat
+    Output:
+    dict. {'seconds':best time, 'count':items, 'rate':items per second}
+    '''
+    best = None
+    for i in range(runs or (1 if cold else repeat)):
+        if cold:
+            _clear_caches()
+        t = time.perf_counter()
+        n = f()
+        t = time.perf_counter()-t
+        best = t if best is None else min(best,t)
+    count = count if count is not None else n
+    return {'seconds':round(best,6),'count':count,'rate':round(count/best,1) if best else None}
+
+def _clear_caches():
+    '''
+    Clear every memoized function of the math dice modules
+    '''
+    for m in [mp,mh,ms,db]:
+        for f in vars(m).values():
+            if hasattr(f,'cache_clear'):
+                f.cache_clear()
+
+def _name(w_dice,n_unary):
+    '''
+    Benchmark config name: (1,1,1,1,6),1 --> '11116u1'
+    '''
+    return f'{ms._w_str(w_dice)}u{n_unary}'
+
+#########################################################################################
+# Runs
+
+def run(names=None,quick=False):
+    '''
+    Run benchmarks
+    Input:
+    names: list of str. benchmarks to run (see benchmarks). If none, all
+    quick: bool. if true, generate only up to quick_unary unaries, and time a
+        quick_fraction of enum_limit expressions
+    Output:
+    dict. {'meta':{commit, python, platform, time, quick}, 'results':{name:timing}}
+    '''
+    assert all([n in benchmarks for n in names or []]), f'Benchmarks: {", ".join(benchmarks)}'
+    results = {}
+    for name in names or benchmarks:
+        results.update(benchmarks[name](quick))
+    return {'meta':_meta(quick),'results':results}
+
+def compare(old,new):
+    '''
+    Compare two runs, benchmark by benchmark
+    Input:
+    old, new: dict. from run
+    Output:
+    str. one line per benchmark in both: old and new seconds, new/old ratio
+    '''
+    both = [k for k in new['results'] if k in old['results']]
+    w = max([len(k) for k in both],default=0)
+    fmt = lambda k,a,b: f'{k:{w}} {a:10.4f}s {b:10.4f}s {b/a if a else float("inf"):7.2f}x'
+    return '\n'.join([fmt(k,old['results'][k]['seconds'],new['results'][k]['seconds'])\
+            for k in both])
+
+def _meta(quick):
+    '''
+    Where and when a run was made
+    '''
+    try:
+        commit = subprocess.run(['git','rev-parse','--short','HEAD'],capture_output=True,\
+                text=True,cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'commit':commit or None,'python':platform.python_version(),\
+            'platform':platform.platform(),'time':time.strftime('%Y-%m-%dT%H:%M:%S'),\
+            'quick':quick}
+
+#########################################################################################
+# Main
+
+if __name__ == '__main__':
+    # python3 md_bench.py [-q] [-o out.json] [-c baseline.json] [benchmark ...]
+    parser = argparse.ArgumentParser(description='Math Dice Benchmarks')
+    parser.add_argument('names', nargs='*',\
+            help=f'Benchmarks to Run: {", ".join(benchmarks)} (Default: All)')
+    parser.add_argument('-q', '--quick', action='store_true',\
+            help=f'Generate Only up to {quick_unary} Unary, Time 1/{quick_fraction} of the Expressions')
+    parser.add_argument('-o', '--out', default=None, help='Write Results as JSON Here')
+    parser.add_argument('-c', '--compare', default=None, help='Compare to Earlier Results')
+    args = parser.parse_args()
+    out = run(args.names,args.quick)
+    for k,v in out['results'].items():
+        print(f'{k:48} {v["seconds"]:10.4f}s'+(f' {v["rate"]:>12}/s' if v['rate'] else ''))
+    if args.out:
+        with open(args.out,'w') as f:
+            json.dump(out,f,indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            print(compare(json.load(f),out))
@@ -0,0 +1,387 @@
+# Math Dice Solutions Store
+# Single-file indexed solutions database
+# Skye Rhomberg
+
+import os
+import re
+import mmap
+import struct
+import tarfile
+import pickle as pkl
+import md_humanizer as h
+import md_parser as mp
+from multiprocessing import Pool
+from bisect import bisect_right
+from functools import lru_cache
+
+#########################################################################################
+# File Format
+
+# File Layout:
+#   header: magic, version, number of entries, offset of index
+#   data: one block per entry. All of an entry's expressions have the same length
+#       (5 digits, 4 binary ops, n unary ops), so each block is
+#       [count x width token codes][count scores], rows sorted by score
+#   humanized: optional. one block per (white dice, black total): md_humanizer.humanize
+#       of all its solutions, pickled in two parts: best-scoring groups, then the rest
+#   index: one fixed-size record per (white dice, black total, unary count)
+#       --> offset, row count and expression width of that entry's block
+#   humanized index: one fixed-size record per (white dice, black total)
+#       --> offset and lengths of that configuration's humanized block
+MAGIC = b'MDSB'
+VERSION = 3
+# Header: magic, version, n_entries, index offset, n_humanized, humanized index offset
+header = struct.Struct('<4sHIQIQ')
+# Index Record: white dice ('11236'), black total, unary count, offset, count, width
+record = struct.Struct('<5sBBQIB')
+# Humanized Index Record: white dice, black total, offset, best part length, rest length
+h_record = struct.Struct('<5sBQII')
+# Token Codes: one byte per postfix token, the opcodes of md_parser.evaluate_many
+tokens = ''.join(mp.opcodes)
+encode = bytes.maketrans(tokens.encode(),bytes(range(1,len(tokens)+1)))
+decode = bytes.maketrans(bytes(range(1,len(tokens)+1)),tokens.encode())
+# Legacy directory layout: <db>/<w_dice>/<b_dice>/u<n>.p
+legacy_path = re.compile(r'(?:^|/)([1-6]{5})/(\d+)/u(\d+)\.p$')
+legacy_combo = re.compile(r'[1-6]{5}')
+
+#########################################################################################
+# Reading
+
+def is_db(path):
+    '''
+    Check whether path is a single-file solutions store (vs a legacy sols directory)
+    '''
+    return os.path.isfile(path)
+
+def get_sols(w_dice,b_dice,path,just_best=False):
+    '''
+    Find All Solutions to given configuration in a solutions store
+    Only the rows returned are decoded, straight out of the memory-mapped file
+    Input:
+    w_dice: 5-tuple of int. white dice combination
+    b_dice: int. black dice total
+    path: str. solutions store file
+    just_best: bool. If true, only solutions with the best score
+    Output: list. [(solution,score),(solution,score)] over all unary counts
+    '''
+    mv,index,h_index = _open(path,os.stat(path).st_mtime_ns)
+    entries = index.get((_w_str(w_dice),b_dice),[])
+    best = min([mv[o+c*w] for n,o,c,w in entries]) if just_best and entries else None
+    sols = []
+    for n_unary,offset,count,width in entries:
+        # Rows are sorted by score: best rows are a prefix
+        stop = bisect_right(mv[offset+count*width:offset+count*(width+1)],best)\
+                if just_best else count
+        sols.extend(_rows(mv,offset,count,width,stop))
+    return sols
+
+def best_score(w_dice,b_dice,path):
+    '''
+    Best score of any solution to given configuration, without decoding any solution
+    Input:
+    w_dice: 5-tuple of int. white dice combination
+    b_dice: int. black dice total
+    path: str. solutions store file
+    Output: int or None. best score, None if no solutions
+    '''
+    mv,index,h_index = _open(path,os.stat(path).st_mtime_ns)
+    entries = index.get((_w_str(w_dice),b_dice),[])
+    return min([mv[o+c*w] for n,o,c,w in entries]) if entries else None
+
+def keys(path):
+    '''
+    All (white dice, black total, unary count) entries in a solutions store
+    Input:
+    path: str. solutions store file
+    Output: list of (str,int,int). e.g. ('11236',24,0)
+    '''
+    mv,index,h_index = _open(path,os.stat(path).st_mtime_ns)
+    return sorted((w,b,e[0]) for (w,b) in index for e in index[(w,b)])
+
+def solvability(src):
+    '''
+    Solvability index: which black totals each white dice combo solves with each number
+    of unaries, as bitsets over the totals (see total_bit)
+    A store's index is read once per version of the file. A legacy directory is listed,
+    without loading any solutions, once per version of it, and in each listing only the
+    combo directories changed since are read again (see _legacy_solvability)
+    Input:
+    src: str. solutions store file or legacy sols directory
+    Output:
+    dict. w_dice:tuple of int. e.g. '11236':(totals solved with exactly 0 unaries,
+        with exactly 1, ...)
+    '''
+    if is_db(src):
+        return _store_solvability(src,os.stat(src).st_mtime_ns)
+    return _legacy_solvability(src,os.stat(src).st_mtime_ns)
+
+def touch(db_name):
+    '''
+    Mark a legacy sols directory changed after writing into one of its combo directories,
+    which doesn't change the directory's own mtime (see _legacy_solvability)
+    '''
+    os.utime(db_name)
+
+def total_bit(b_dice):
+    '''
+    Bit of a black dice total in solvability bitsets: 11 --> 0, 12 --> 1, ..., 66 --> 35
+    '''
+    return 6*(b_dice//10-1)+b_dice%10-1
+
+@lru_cache(maxsize=8)
+def _store_solvability(path,mtime):
+    '''
+    Solvability index of a solutions store, once per version of the file
+    '''
+    mv,index,h_index = _open(path,mtime)
+    return _solvability((w,b,e[0]) for (w,b) in index for e in index[(w,b)])
+
+@lru_cache(maxsize=8)
+def _legacy_solvability(path,mtime):
+    '''
+    Solvability index of a legacy sols directory, once per version of the directory
+    Its mtime changes when combos are added, and writers into existing combos touch it
+    '''
+    masks = {}
+    for e in os.scandir(path):
+        if legacy_combo.fullmatch(e.name) and e.is_dir():
+            masks.update(_combo_solvability(e.path,e.stat().st_mtime_ns))
+    return masks
+
+@lru_cache(maxsize=1024)
+def _combo_solvability(path,mtime):
+    '''
+    Solvability index of one combo directory of a legacy sols directory
+    Every write to a combo (make_sols_db, live solving) renames its files out of the
+    combo directory or marks it done there, so the directory's mtime changes with them
+    '''
+    return _solvability(_legacy_keys(path))
+
+def _solvability(keys):
+    '''
+    Build a solvability index
+    Input:
+    keys: iterable of (str,int,int). (w_dice,b_dice,n_unary) entries with solutions
+    Output:
+    dict. see solvability
+    '''
+    masks = {}
+    for w,b,n in keys:
+        m = masks.setdefault(w,[])
+        m.extend([0]*(n+1-len(m)))
+        m[n] |= 1 << total_bit(b)
+    return {w:tuple(m) for w,m in masks.items()}
+
+def has_humanized(path):
+    '''
+    Check whether a solutions store was built with humanized results (see humanize_db)
+    '''
+    return bool(_open(path,os.stat(path).st_mtime_ns)[2])
+
+def get_humanized(w_dice,b_dice,path,just_best=False):
+    '''
+    Precomputed md_humanizer.humanize of all solutions to given configuration
+    Input:
+    w_dice: 5-tuple of int. white dice combination
+    b_dice: int. black dice total
+    path: str. solutions store file
+    just_best: bool. If true, only groups with the best score
+    Output:
+    list or None. ((normalized-infix,score),[equivalents]) as from humanize,
+    None if the store was built without humanized results
+    '''
+    mv,index,h_index = _open(path,os.stat(path).st_mtime_ns)
+    if not h_index:
+        return None
+    if (key := (_w_str(w_dice),b_dice)) not in h_index:
+        return []
+    offset,best_len,rest_len = h_index[key]
+    hs = pkl.loads(mv[offset:offset+best_len])
+    return hs if just_best else hs+pkl.loads(mv[offset+best_len:offset+best_len+rest_len])
+
+@lru_cache(maxsize=8)
+def _open(path,mtime):
+    '''
+    Memory-map a solutions store and read its index, once per version of the file
+    Input:
+    path: str. solutions store file
+    mtime: int. modification time, so a rewritten file is reopened
+    Output:
+    (memoryview,dict,dict). (whole file,
+        index (w_dice,b_dice):[(n_unary,offset,count,width)],
+        humanized index (w_dice,b_dice):(offset,best_len,rest_len))
+    '''
+    with open(path,'rb') as f:
+        mv = memoryview(mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ))
+    magic,version,n_entries,index_offset,n_human,h_offset = header.unpack(mv[:header.size])
+    assert magic == MAGIC, f'Not a solutions store: {path}'
+    assert version == VERSION, f'Unsupported solutions store version: {version}'
+    index = {}
+    for w,b,n,o,c,wd in record.iter_unpack(mv[index_offset:index_offset+record.size*n_entries]):
+        # Empty entries (written by older versions) have no block to read
+        if c:
+            index.setdefault((w.decode(),b),[]).append((n,o,c,wd))
+    h_index = {(w.decode(),b):(o,bl,rl) for w,b,o,bl,rl in\
+            h_record.iter_unpack(mv[h_offset:h_offset+h_record.size*n_human])}
+    return mv,index,h_index
+
+def _rows(mv,offset,count,width,stop):
+    '''
+    Decode the first rows of an entry block
+    Input:
+    mv: memoryview. whole store file
+    offset,count,width: int. entry block from the index
+    stop: int. number of rows to decode
+    Output:
+    list. [(solution,score),(solution,score)]
+    '''
+    exprs = bytes(mv[offset:offset+stop*width]).translate(decode).decode()
+    scores = mv[offset+count*width:offset+count*width+stop].tolist()
+    return list(zip([exprs[i:i+width] for i in range(0,stop*width,width)],scores))
+
+def _w_str(w_dice):
+    '''
+    White dice as a store key: (3,1,2,6,1) --> '11236'
+    '''
+    return ''.join([str(w) for w in sorted(w_dice)])
+
+#########################################################################################
+# Writing
+
+def write_db(path,entries,humanized=()):
+    '''
+    Write a solutions store
+    Entries are streamed to disk one at a time,
+    the file is built under a temporary name and renamed into place
+    Input:
+    path: str. solutions store file
+    entries: iterable of ((w_dice,b_dice,n_unary),sols)
+        w_dice: str or tuple of int. white dice, e.g. '11236'
+        b_dice: int. black dice total
+        n_unary: int. number of unary ops
+        sols: list. [(solution,score),(solution,score)], all solutions the same length.
+            Skipped if empty
+    humanized: iterable of ((w_dice,b_dice),h_sols)
+        h_sols: list. md_humanizer.humanize of all solutions to the configuration
+    '''
+    tmp = f'{path}.tmp'
+    index = []
+    h_index = []
+    with open(tmp,'wb') as out:
+        # Placeholder header until the index offsets are known
+        out.write(header.pack(MAGIC,VERSION,0,0,0,0))
+        for (w,b,n),sols in entries:
+            # No solutions (e.g. a legacy u*.p file holding []): no entry
+            if not sols:
+                continue
+            sols = sorted(sols,key=lambda x: x[1])
+            width = len(sols[0][0])
+            assert all(len(e) == width for e,sc in sols), 'Solutions of unequal length'
+            index.append(record.pack(_w_str(map(int,w)).encode(),b,n,out.tell(),len(sols),width))
+            out.write(''.join([e for e,sc in sols]).encode().translate(encode))
+            out.write(bytes([sc for e,sc in sols]))
+        for (w,b),hs in humanized:
+            # Best-scoring groups pickled separately so they can be read alone
+            k = len([g for g in hs if g[0][1] == hs[0][0][1]]) if hs else 0
+            best,rest = pkl.dumps(hs[:k]),pkl.dumps(hs[k:])
+            h_index.append(h_record.pack(_w_str(map(int,w)).encode(),b,out.tell(),\
+                    len(best),len(rest)))
+            out.write(best+rest)
+        index_offset = out.tell()
+        out.write(b''.join(index))
+        h_offset = out.tell()
+        out.write(b''.join(h_index))
+        out.seek(0)
+        out.write(header.pack(MAGIC,VERSION,len(index),index_offset,len(h_index),h_offset))
+    os.replace(tmp,path)
+
+def pack_db(src,path,humanized=True,jobs=1):
+    '''
+    Convert a legacy sols db to a single-file solutions store
+    Input:
+    src: str. legacy db: sols directory or tarball of it (e.g. sols.tar.gz)
+    path: str. solutions store file to write
+    humanized: bool. if true, also precompute humanized results (see humanize_db)
+    jobs: int. number of worker processes for humanizing
+    '''
+    write_db(path,_read_legacy(src))
+    if humanized:
+        humanize_db(path,jobs)
+
+def humanize_db(path,jobs=1):
+    '''
+    Build stage: store md_humanizer.humanize of every configuration in a solutions store,
+    so queries can read it instead of normalizing every solution
+    The store is rewritten with its solutions unchanged
+    Input:
+    path: str. solutions store file
+    jobs: int. number of worker processes
+    '''
+    mv,index,h_index = _open(path,os.stat(path).st_mtime_ns)
+    tasks = [(path,w,b) for w,b in sorted(index)]
+    entries = (((w,b,n),_rows(mv,o,c,wd,c)) for w,b in sorted(index) for n,o,c,wd in index[(w,b)])
+    if jobs > 1:
+        with Pool(jobs) as pool:
+            write_db(path,entries,pool.imap(_humanize_one,tasks,chunksize=4))
+    else:
+        write_db(path,entries,map(_humanize_one,tasks))
+
+def _humanize_one(task):
+    '''
+    Worker for humanize_db: humanize one configuration's solutions
+    Input:
+    task: tuple. (path,w_dice,b_dice)
+    Output:
+    ((str,int),list). ((w_dice,b_dice),humanized solutions)
+    '''
+    path,w,b = task
+    return (w,b),h.humanize(get_sols(tuple(map(int,w)),b,path))
+
+def _legacy_keys(src):
+    '''
+    List the entries of a legacy sols directory
+    Input:
+    src: str. sols directory, or one of its combo directories
+    Output:
+    generator of (str,int,int). (w_dice,b_dice,n_unary)
+    '''
+    for root,dirs,files in os.walk(src):
+        for f in files:
+            if m := legacy_path.search(os.path.join(root,f).replace(os.sep,'/')):
+                yield m[1],int(m[2]),int(m[3])
+
+def _read_legacy(src):
+    '''
+    Read every solutions file in a legacy sols directory or tarball
+    Input:
+    src: str. sols directory or tarball
+    Output:
+    generator of ((w_dice,b_dice,n_unary),sols)
+    '''
+    if os.path.isdir(src):
+        for root,dirs,files in os.walk(src):
+            for f in files:
+                if m := legacy_path.search(os.path.join(root,f).replace(os.sep,'/')):
+                    with open(os.path.join(root,f),'rb') as u:
+                        yield (m[1],int(m[2]),int(m[3])),load_sols(u)
+    else:
+        with tarfile.open(src) as tar:
+            for member in tar:
+                if member.isfile() and (m := legacy_path.search(member.name)):
+                    yield (m[1],int(m[2]),int(m[3])),load_sols(tar.extractfile(member))
+
+def load_sols(f):
+    '''
+    Read a legacy solutions file: one pickled list, or several appended by a streaming
+    run (see md_solver.make_sols_db)
+    Input:
+    f: binary file object
+    Output:
+    list. [(solution,score),(solution,score)]
+    '''
+    sols = []
+    while True:
+        try:
+            sols.extend(pkl.load(f))
+        except EOFError:
+            return sols
@@ -0,0 +1,180 @@
+# Math Dice Difficulty
+# Rate every configuration of a solutions db once, then draw puzzles of a given
+# difficulty in constant time
+# Skye Rhomberg
+
+import os
+import random
+import pickle as pkl
+import itertools as it
+import md_solver as ms
+import md_db as db
+from math import factorial, prod
+from multiprocessing import Pool
+from functools import lru_cache
+from contextlib import nullcontext
+from collections import Counter
+
+#########################################################################################
+# Difficulty
+# Each solvable configuration is rated by the best score of its solutions, how many
+# distinct solutions (normal forms) it has, and the fewest unary ops (! or ?) it needs,
+# and put in a band. Unsolvable configurations are in no band, and never drawn
+
+# Normal forms a configuration solvable without penalties needs to be easy
+many_forms = 10
+# Band: test of (best score, normal forms, fewest unaries), in order of difficulty
+bands = {'easy':lambda s,f,u: s == 0 and f >= many_forms,\
+        'medium':lambda s,f,u: u == 0 and (s > 0 or f < many_forms),\
+        'hard':lambda s,f,u: 0 < u <= 2,\
+        'expert':lambda s,f,u: u > 2}
+# Band of every solvable configuration
+any_band = 'any'
+# Index file format version
+version = 1
+
+def band(score,forms,n_unary):
+    '''
+    Difficulty band of a configuration (see bands)
+    Input:
+    score: int. best score of its solutions
+    forms: int. number of normal forms of its solutions
+    n_unary: int. fewest unary ops that solve it
+    Output:
+    str or None. band, None if unsolvable
+    '''
+    if n_unary is None:
+        return None
+    return next((b for b,t in bands.items() if t(score,forms,n_unary)),None)
+
+#########################################################################################
+# Index
+# Pickled dict next to the db (see index_path):
+#   'version': version
+#   'stats': {(white dice, black total): (best score, normal forms, fewest unaries)},
+#       (None,0,None) if unsolvable
+#   'bands': {band: (configurations, probabilities, aliases)}, alias tables over the
+#       band's configurations (see _alias), weighted by how likely each is to be rolled
+#       (see roll_weight). any_band holds all solvable configurations
+
+def index_path(db_name):
+    '''
+    Difficulty index file of a solutions db: sols.mdb --> sols.mdb.difficulty
+    '''
+    return db_name.rstrip(os.sep)+'.difficulty'
+
+def build_index(db_name,path=None,jobs=1,verbose=False):
+    '''
+    Rate every configuration of a solutions db and save the index
+    Input:
+    db_name: str. solutions store or legacy directory (see md_solver.get_sols)
+    path: str. index file to write. If none, index_path(db_name)
+    jobs: int. number of worker processes (humanizing a legacy db is slow)
+    verbose: bool. if true, print each white dice combo as it is rated
+    Output:
+    dict. the index
+    '''
+    assert db.is_db(db_name) or os.path.isdir(db_name), f'No solutions db {db_name}'
+    tasks = [(w_dice,db_name) for w_dice in it.combinations_with_replacement(range(1,7),5)]
+    stats = {}
+    with (Pool(jobs) if jobs > 1 else nullcontext()) as pool:
+        for w_dice,s in (pool.imap_unordered if pool else map)(_rate_task,tasks):
+            if verbose:
+                print(f'{ms._w_str(w_dice)}: '+', '.join([f'{b} {n}' for b,n in\
+                        Counter([band(*v) for v in s.values()]).items()]))
+            stats.update(s)
+    stats = dict(sorted(stats.items()))
+    groups = {b:[c for c,s in stats.items() if band(*s) == b] for b in bands}
+    groups[any_band] = [c for c,s in stats.items() if band(*s)]
+    tables = {b:(cs,)+_alias([roll_weight(w) for w,_ in cs]) for b,cs in groups.items()}
+    index = {'version':version,'stats':stats,'bands':tables}
+    path = path or index_path(db_name)
+    with open(path+'.tmp','wb') as f:
+        pkl.dump(index,f)
+    os.replace(path+'.tmp',path)
+    return index
+
+def load_index(path):
+    '''
+    Difficulty index saved by build_index, read once per change of the file
+    Input:
+    path: str. index file
+    Output:
+    dict. the index
+    '''
+    return _load(path,os.stat(path).st_mtime_ns)
+
+def sample(index,band=None,rng=random):
+    '''
+    Draw a configuration in a difficulty band, as likely as rolling it, in constant time
+    Input:
+    index: dict. from load_index or build_index
+    band: str. difficulty band (see bands). If none, any solvable configuration
+    rng: Random. random source
+    Output:
+    (tuple,int). (white dice, black total)
+    '''
+    cs,prob,alias = index['bands'][band or any_band]
+    assert cs, f'No configurations in band {band}'
+    i = rng.randrange(len(cs))
+    return cs[i] if rng.random() < prob[i] else cs[alias[i]]
+
+def roll_weight(w_dice):
+    '''
+    Number of ordered rolls of five dice giving these white dice: (1,1,2,3,6) --> 60
+    Every black total is equally likely
+    '''
+    repeats = [len(list(g)) for _,g in it.groupby(sorted(w_dice))]
+    return factorial(len(w_dice))//prod([factorial(r) for r in repeats])
+
+def _rate_task(task):
+    '''
+    Worker for build_index: rate every black total of one white dice combo
+    Input:
+    task: tuple. (w_dice,db_name)
+    Output:
+    (tuple,dict). (w_dice, {(w_dice,b_dice):(best score, normal forms, fewest unaries)})
+    '''
+    w_dice,db_name = task
+    # Solvability bitsets read once per combo, not per total (see md_solver.min_unary)
+    masks = db.solvability(db_name).get(ms._w_str(w_dice),())[:ms.live_max_unary+1]
+    stats = {}
+    for b_dice in ms.valid_ans:
+        n = next((n for n,m in enumerate(masks) if m >> db.total_bit(b_dice) & 1),None)
+        hs = ms.get_humanized(w_dice,b_dice,db_name) if n is not None else []
+        stats[(w_dice,b_dice)] = (hs[0][0][1],len(hs),n) if hs else (None,0,None)
+    return w_dice,stats
+
+@lru_cache(maxsize=8)
+def _load(path,mtime):
+    '''
+    Unpickle an index file. mtime is only part of the key
+    '''
+    with open(path,'rb') as f:
+        index = pkl.load(f)
+    assert index.get('version') == version, f'{path}: old index, rebuild it'
+    return index
+
+def _alias(weights):
+    '''
+    Alias table for drawing index i with probability weights[i]/sum(weights) in
+    constant time (Vose): draw a column i uniformly, keep it with probability prob[i],
+    else take alias[i]
+    Input:
+    weights: list of number
+    Output:
+    (list of float,list of int). (prob, alias)
+    '''
+    n,total = len(weights),sum(weights)
+    prob,alias = [w*n/total for w in weights],list(range(n))
+    small = [i for i,p in enumerate(prob) if p < 1]
+    large = [i for i,p in enumerate(prob) if p >= 1]
+    while small and large:
+        s,l = small.pop(),large.pop()
+        alias[s] = l
+        prob[l] -= 1-prob[s]
+        (small if prob[l] < 1 else large).append(l)
+    # Left over only through rounding: always kept
+    for i in small+large:
+        prob[i] = 1.0
+    return prob,alias
@@ -0,0 +1,227 @@
+# Math Dice Batch Grading
+# Check files of submitted solutions, loading each configuration's solutions once
+# Skye Rhomberg
+
+import csv
+import sys
+import json
+import time
+import itertools as it
+import md_parser as mp
+import md_humanizer as mh
+import md_solver as ms
+from multiprocessing import Pool
+from functools import lru_cache
+from contextlib import nullcontext
+
+#########################################################################################
+# Formats
+# Input: CSV with a header row (or columns white,black,solution without one), or JSON
+#   lines, one object per row. White dice as 12345, "1 2 3 4 5" or [1,2,3,4,5], the
+#   solution in infix. Other columns (player, round...) are passed through
+#   white,black,solution,player
+#   12346,24,(6-2)*(4+3-1),ann
+# Output: the input row plus its grade (see grade), as JSON lines, or CSV if the output
+#   file name ends in .csv. Rows stay in input order
+
+# Accepted names of the input columns
+columns = {'white':['white','w_dice','w'],'black':['black','b_dice','b'],\
+        'solution':['solution','sol','answer']}
+# Grade fields, in output order
+fields = ['value','correct','wrong_dice','score','normalized','best_score','optimal','best',\
+        'error']
+# Rows read at once. Rows of the same configuration in a chunk go to the same worker and
+# share one lookup; configurations are also kept across chunks (see config_cache)
+chunk = 2000
+# Configurations whose best solutions are kept in memory, per process
+config_cache = 4096
+# Distinct (configuration, solution) grades kept in memory, per process: many players
+# give the same answer
+grade_cache = 1<<16
+# Rows between progress lines in verbose mode
+progress_rows = 100000
+
+#########################################################################################
+# Grading
+
+def grade(w_dice,b_dice,solution,db_name):
+    '''
+    Grade one solution, as the analyze mode of math_dice does
+    Input:
+    w_dice: 5-tuple of int. sorted white dice
+    b_dice: int. black dice total
+    solution: str. INFIX solution
+    db_name: str. solutions db (see md_solver.get_sols)
+    Output:
+    dict. {value: int or None, correct, wrong_dice, score, normalized (if correct),
+        best_score (None if unsolvable), optimal, best (a best-scoring normalized
+        solution), error (why there is no value, else None)}
+    '''
+    best_score,best = _best(w_dice,b_dice,db_name,ms.live_dir)
+    g = {'value':None,'correct':False,'wrong_dice':False,'score':None,'normalized':None,\
+            'best_score':best_score,'optimal':False,'best':best,'error':None}
+    g['wrong_dice'] = tuple(sorted([int(t) for t in solution if t.isdigit()])) != w_dice
+    try:
+        postfix = mp.shunt(mp.tokenize(solution))
+    except AssertionError as err:
+        g['error'] = str(err)
+        return g
+    # Unmatched )
+    except IndexError:
+        g['error'] = 'unbalanced parends'
+        return g
+    value = mp.evaluate(postfix,mode='postfix')
+    if type(value) is not int:
+        g['error'] = str(value)
+        return g
+    g['value'],g['score'] = value,mp.score(solution)
+    g['correct'] = value == b_dice and not g['wrong_dice']
+    if g['correct']:
+        g['normalized'] = mh.normalize(postfix)
+        g['optimal'] = g['score'] == best_score
+    return g
+
+def grade_rows(rows,db_name,pool=None):
+    '''
+    Grade rows, looking up each configuration once
+    Input:
+    rows: list of dict. input rows (see Formats)
+    db_name: str. solutions db (see md_solver.get_sols)
+    pool: Pool. if given, configurations are graded in its workers
+    Output:
+    list of dict. each row with its grade, in order
+    '''
+    out,groups = [None]*len(rows),{}
+    for i,row in enumerate(rows):
+        try:
+            w_dice,b_dice,sol = _config(row)
+        except (KeyError,ValueError,TypeError,AssertionError) as err:
+            out[i] = {**row,**dict.fromkeys(fields),'error':f'Bad Row: {err!r}'}
+            continue
+        groups.setdefault((w_dice,b_dice),[]).append((i,row[sol]))
+    tasks = [(w,b,[sol for i,sol in g],db_name,ms.live_dir) for (w,b),g in groups.items()]
+    for g,grades in zip(groups.values(),(pool.imap if pool else map)(_grade_task,tasks)):
+        for (i,sol),grd in zip(g,grades):
+            out[i] = {**rows[i],**grd}
+    return out
+
+def grade_file(src,dst,db_name,jobs=1,verbose=False):
+    '''
+    Grade a file of solutions, streaming the graded rows to another
+    The file is read chunk rows at a time, and each chunk's configurations spread over
+    the workers
+    Input:
+    src: str. input file (see Formats)
+    dst: str. output file (see Formats)
+    db_name: str. solutions db (see md_solver.get_sols)
+    jobs: int. number of worker processes
+    verbose: bool. if true, print a progress line every progress_rows rows
+    Output:
+    dict. {'rows','correct','optimal','errors','seconds','rate'}, rate in rows per second
+    '''
+    start,counts = time.perf_counter(),dict.fromkeys(['rows','correct','optimal','errors'],0)
+    with open(dst,'w',newline='') as f, (Pool(jobs) if jobs > 1 else nullcontext()) as pool:
+        write = _writer(f,dst.endswith('.csv'))
+        for rows in _chunks(read_rows(src)):
+            for g in grade_rows(rows,db_name,pool):
+                write(g)
+                counts['rows'] += 1
+                counts['correct'] += bool(g['correct'])
+                counts['optimal'] += bool(g['optimal'])
+                counts['errors'] += g['error'] is not None
+                if verbose and not counts['rows'] % progress_rows:
+                    t = time.perf_counter()-start
+                    print(f'{counts["rows"]} rows, {counts["rows"]/t:.0f} rows/s',\
+                            file=sys.stderr)
+    t = time.perf_counter()-start
+    return {**counts,'seconds':round(t,3),'rate':round(counts['rows']/max(t,1e-9),1)}
+
+def _grade_task(task):
+    '''
+    Worker for grade_rows: grade one configuration's solutions
+    Input:
+    task: tuple. (w_dice,b_dice,solutions,db_name,live_dir)
+    Output:
+    list of dict. grade of each solution (see grade)
+    '''
+    w_dice,b_dice,sols,db_name,ms.live_dir = task
+    return [_grade(w_dice,b_dice,sol,db_name,ms.live_dir) for sol in sols]
+
+@lru_cache(maxsize=grade_cache)
+def _grade(w_dice,b_dice,solution,db_name,live_dir):
+    '''
+    Memoized grade. live_dir is only part of the key (see md_solver.live_sols)
+    '''
+    return grade(w_dice,b_dice,solution,db_name)
+
+@lru_cache(maxsize=config_cache)
+def _best(w_dice,b_dice,db_name,live_dir):
+    '''
+    Best score and a best normalized solution of a configuration, (None,None) if it has
+    none. live_dir is only part of the key (see md_solver.live_sols)
+    '''
+    hs = ms.get_humanized(w_dice,b_dice,db_name,True)
+    return (hs[0][0][1],hs[0][0][0]) if hs else (None,None)
+
+def _config(row):
+    '''
+    (sorted white dice, black total, solution column) of an input row
+    '''
+    white,black,sol = _names(tuple(row))
+    w = row[white] if type(row[white]) is list else\
+            [d for d in str(row[white]) if not d.isspace()]
+    w_dice = tuple(sorted([int(d) for d in w]))
+    assert len(w_dice) == 5, 'need 5 white dice'
+    assert type(row[sol]) is str, 'solution is not a string'
+    return w_dice,int(row[black]),sol
+
+@lru_cache(maxsize=None)
+def _names(keys):
+    '''
+    Names of the white, black and solution columns among a row's keys (see columns)
+    '''
+    return tuple([next((k for k in columns[c] if k in keys),c) for c in columns])
+
+#########################################################################################
+# Reading and Writing
+
+def read_rows(src):
+    '''
+    Input rows of a CSV or JSON lines file (see Formats)
+    Input:
+    src: str. file name
+    Output:
+    generator of dict. rows
+    '''
+    with open(src,newline='') as f:
+        first = f.readline()
+        f.seek(0)
+        if first.lstrip().startswith('{'):
+            yield from (json.loads(l) for l in f if l.strip())
+            return
+        header = next(csv.reader([first]),[])
+        # No header: the first row is data
+        names = None if set(header)&set(columns['solution']) else list(columns)
+        yield from csv.DictReader(f,names)
+
+def _chunks(rows):
+    '''
+    Split rows into lists of chunk rows
+    '''
+    while c := list(it.islice(rows,chunk)):
+        yield c
+
+def _writer(f,as_csv):
+    '''
+    Function writing one graded row to an open file, as CSV or a JSON line
+    '''
+    if not as_csv:
+        return lambda g: f.write(json.dumps(g)+'\n')
+    out = []
+    def write(g):
+        # Header from the first row's columns
+        if not out:
+            out.append(csv.DictWriter(f,list(g),extrasaction='ignore'))
+            out[0].writeheader()
+        out[0].writerow(g)
+    return write
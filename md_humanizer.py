@@ -4,6 +4,7 @@
 
 import re
 import md_parser as mp
+from functools import lru_cache
 
 #########################################################################################
 # Parse-Tree Conversion
@@ -26,43 +27,35 @@ def to_tree(expr):
 def to_expr(tree,mode='smart'):
     '''
     Convert parse-tree back to expression
+    Rendered through an expression node (see md_parser.node_infix), so each
+    subexpression's parends are decided from its operators' precedence in one step
     Input:
     tree: list. parse-tree where nested sublists are subtrees
+    mode: str. parenthesizing mode: smart, normal or full
     Output:
-    str. infix expression from tree -- parends turned to "smart" mode
+    str. infix expression from tree, parenthesized per mode
     '''
-    return _expr(tree,mode)
+    assert mode in ['smart','full','normal'], 'Invalid Mode'
+    return mp.node_infix(_tree_node(tree),mode)
 
-def _parend(subexpr,mode):
+def _tree_node(tree):
     '''
-    Appropriately parenthesize an expression of arbitrary length
+    Expression node of a parse-tree
+    ['7','*',['6','+','3','+',['3','!']]] --> ('*',(7,('+',(6,3,('!',(3,))))))
     Input:
-    subexpr: list of str. sub-expression e.g. ['1','+','3','+','6'] or ['(3*2)-1','?']
+    tree: str or list. parse-tree or a single symbol
     Output:
-    str. appropriately parenthesized combined sub-expression from list
+    tuple. expression node (see md_parser.node)
     '''
-    # Length 2: Unary operation 
-    if len(subexpr) == 2:
-        # First element is operand, second is operator, parenthesize returns 1-len list
-        return mp.parenthesize([subexpr[0]],subexpr[1],mode)[0] + subexpr[1]
-    # Length 3: Regular binary operation
-    if len(subexpr) == 3:
-        return subexpr[1].join(mp.parenthesize(subexpr[::2],subexpr[1],mode))
-    # Longer: multiple binary exprs with same operator + or *
-    return subexpr[1].join(mp.parenthesize_multi(subexpr[::2],subexpr[1],mode))
-
-def _expr(subexpr,mode):
-    '''
-    Recursively build up expression from parse-tree
-    Input:
-    subexpr: str or list of str. piece of expression
-    Output:
-    str. expression from that part
-    '''
-    # Base Case: already a str
-    if type(subexpr) is str:
-        return subexpr
-    return _parend([_expr(t,mode) for t in subexpr],mode)
+    # Base Case: a single symbol
+    if type(tree) is str:
+        return mp.node(tree)
+    args = [_tree_node(t) for t in tree[::2]]
+    # Unary operation, or a lone parenthesized subtree
+    if len(tree) < 3:
+        return mp.node(tree[1],*args) if len(tree) == 2 else args[0]
+    # Binary operation, or a chain of + or * (one operator, as with "normal" parends)
+    return mp.node(tree[1],*args)
 
 #########################################################################################
 # Normalization
@@ -124,6 +117,19 @@ def normalize(expr):
         - Unary ops and parended expressions to right
         - Ties broken by lexicography
     - "Implied" parends like 5+(4-3) skipped to re-obtain "smart" parends --> 5+4-3
+    Works on shared expression nodes (see md_parser.node) built straight from the
+    postfix tokens, only rendered to a string at the end. Same result as normalize_str
+    Input:
+    expr: str or list of str. postfix expression
+    Output:
+    str. expression in normal form
+    '''
+    return mp.node_infix(_sort(_dist(_chains(mp.to_node(expr))))[0])
+
+def normalize_str(expr):
+    '''
+    Reference normalizer: same normal form as normalize,
+    by round trips through infix strings and parse-trees (to_tree, to_expr)
     Input:
     expr: str. postfix expression
     Output:
@@ -136,6 +142,68 @@ def normalize(expr):
     # Tree -- (Sort Commute) --> Tree --> Smart Mode Infix
     return to_expr(sort_commute(dds),mode='smart')
 
+#########################################################################################
+# Expression Trees
+
+# Trees are md_parser expression nodes: (token,operand nodes), interned and shared
+# Chains of + or * are kept flat, as with "normal" parends: 1+2+3 --> ('+',(1,2,3))
+# Each rewrite is memoized per distinct subtree
+# Inverse operators, for distributing - and /
+inverse = {'-':'+','/':'*'}
+
+def _node(op,args):
+    '''
+    Make a tree node, splicing operands that continue a + or * chain
+    '''
+    if op in '+*':
+        args = sum([a[1] if a[0] == op else (a,) for a in args],())
+    return mp.node(op,*args)
+
+@lru_cache(maxsize=mp.node_cache)
+def _chains(tree):
+    '''
+    Flatten the + and * chains of a (binary) expression node
+    '''
+    op,args = tree
+    return _node(op,[_chains(a) for a in args]) if args else tree
+
+@lru_cache(maxsize=mp.node_cache)
+def _dist(tree):
+    '''
+    Distribute subtractions and divisions as many times as possible (see dist_div_sub)
+    '''
+    op,args = tree
+    if not args:
+        return tree
+    # a-(b-c) --> a+(c-b), a/(b/c) --> a*(c/b)
+    if op in inverse and args[1][0] == op:
+        return _node(inverse[op],(_dist(args[0]),_dist(mp.node(op,*args[1][1][::-1]))))
+    # a/b^(c-d) --> a*b^(d-c)
+    if op == '/' and args[1][0] == '^' and args[1][1][1][0] == '-':
+        b,e = args[1][1]
+        return _node('*',(_dist(args[0]),_dist(mp.node('^',b,mp.node('-',*e[1][::-1])))))
+    return _node(op,[_dist(a) for a in args])
+
+@lru_cache(maxsize=mp.node_cache)
+def _sort(tree):
+    '''
+    Sort operands of + and * chains (see sort_commute)
+    Each subtree's sort key is built once, from its operands' keys
+    Input:
+    tree: tuple. expression node
+    Output:
+    (tuple,tuple of str). (sorted tree, its infix tokens without parends)
+    '''
+    op,args = tree
+    if not args:
+        return tree,(op,)
+    args = [_sort(a) for a in args]
+    if op in '+*':
+        args.sort(key=lambda a: (len(a[1]),a[1]))
+    flat = args[0][1]+sum([(op,)+f for a,f in args[1:]],()) if len(args) > 1\
+            else args[0][1]+(op,)
+    return mp.node(op,*[a for a,f in args]),flat
+
 #########################################################################################
 # Solutions Organization
 
@@ -153,22 +221,17 @@ def humanize(sols):
     h_sols = {}
     # For each postfix expression
     for (expr,score) in sols:
-        # Normalize and score
-        n = normalize(expr)
-        s = mp.score(n)
-        # If new solution
+        # Normalize and score, smart infix from the same tree
+        tree = mp.to_node(expr)
+        n = mp.node_infix(_sort(_dist(_chains(tree)))[0])
+        s = mp.node_score(tree)
+        i = mp.node_infix(tree)
+        # New solution: start its equivalents
         if (n,s) not in h_sols:
-            # If not already normalized
-            if mp.to_infix(expr,mode='smart') != n:
-                # Add to equivs
-                h_sols[(n,s)] = [mp.to_infix(expr,mode='smart')]
-            else:
-                # Already in key
-                h_sols[(n,s)] = []
-        # If not equal to normalized
-        elif mp.to_infix(expr,mode='smart') != n:
-            # Add to equivs
-            h_sols[(n,s)].append(mp.to_infix(expr,mode='smart'))
+            h_sols[(n,s)] = []
+        # If not equal to normalized, add to equivs
+        if i != n:
+            h_sols[(n,s)].append(i)
     # Remove duplicates caused by infix conversion, sort by lex order
     org_sols = {(n,s): sorted(list(set(h_sols[(n,s)]))) for (n,s) in h_sols}
     # Sort keys by score, then by lex of expr
@@ -178,10 +241,27 @@ def humanize(sols):
 # Test Code
 
 if __name__ == '__main__':
+    import sys, time
+    import md_solver as ms
     ss = ['(1+1)?!??/((1+1)?!+1)','(1+(4-5)+4!+5*5)/4?','5/(((1^4)/3)/3)',\
             '(((1+1)?)*((((1+1)?)!)?))-1']
     for s in ss:
         print(s)
         expr = ''.join(mp.shunt(s))
         print(normalize(expr))
-
+    # Benchmark: per-expression normalizing cost across a full humanize
+    # python3 md_humanizer.py [white dice] [n_unary], e.g. 12346 0
+    w_dice = tuple(int(d) for d in (sys.argv[1] if len(sys.argv) > 1 else '12346'))
+    n_unary = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    sols = sum(ms.gen_valid_solutions(w_dice,None,n_unary).values(),[])
+    print(f'{len(sols)} solutions to {ms._w_str(w_dice)} with {n_unary} unary')
+    for f in [normalize_str,normalize]:
+        t = time.perf_counter()
+        for e,sc in sols:
+            f(e)
+        t = time.perf_counter()-t
+        print(f'{f.__name__:14} {t:8.2f}s {1e6*t/len(sols):8.1f}us/expr')
+    t = time.perf_counter()
+    humanize(sols)
+    t = time.perf_counter()-t
+    print(f'{"humanize":14} {t:8.2f}s {1e6*t/len(sols):8.1f}us/expr')
@@ -4,6 +4,8 @@
 
 import re
 import math
+from fractions import Fraction
+from functools import lru_cache
 
 #########################################################################################
 # Operator Definitions
@@ -22,20 +24,92 @@ n_operands = {'+':2,'-':2,'*':2,'/':2,'^':2,'!':1,'?':1}
 fact = {n:math.factorial(n) for n in range(10)}
 # Termial : n? = n + n-1 + ... + 1
 term = lambda n: (n+1)*(n/2) if n == int(n) and n>=0 else 1/0 
-# Operator Dictionary
-ops = {}
 # Operation Evaluation
 op_calc = {'+':'ops[0]+ops[1]','-':'ops[0]-ops[1]','*':'ops[0]*ops[1]','/':'ops[0]/ops[1]',
         '^':'math.pow(ops[0],ops[1])','!':'fact[ops[0]]','?':'term(ops[0])'}
-# Pre-compute calculation lambdas for speed increase
-calc = {t:eval('lambda: '+op_calc[t]) for t in op_calc}
+# Pre-compute calculation lambdas of their operands for speed: op_func['+'](1,2) --> 3
+op_func = {t:eval('lambda *ops: '+op_calc[t]) for t in op_calc}
+# Exceptions a single bad operation can raise
+calc_errors = (ZeroDivisionError,OverflowError,ValueError,TypeError,KeyError)
+# Exact Calculation: ints where possible, fractions.Fraction otherwise (see exact_func)
+# Powers needing more bits than this are refused before computing, like float overflow
+exact_bits = 1024
+# Opcodes: one small int per postfix token, digits then operators: '1' --> 1, '+' --> 7
+opcodes = {t:i+1 for i,t in enumerate('123456'+operators)}
+# Error codes from evaluate_many
+error_codes = {0:'OK',1:'Invalid Expression',2:'Zero Division',3:'Bad Termial',
+        4:'Bad Factorial',5:'Overflow',6:'Domain',7:'Non-Int Result'}
 # Infix String
 infix = {'+':'{0}+{1}','-':'{0}-{1}','*':'{0}*{1}','/':'{0}/{1}',
         '^':'{0}^{1}','!':'{0}!','?':'{0}?'}
 
+#########################################################################################
+# Exact Calculation
+
+def _exact(v):
+    '''
+    Whole-number fractions back to int, so exact values stay on the int fast path
+    '''
+    return v.numerator if type(v) is Fraction and v.denominator == 1 else v
+
+def _exact_div(a,b):
+    '''
+    a/b exactly: int if it divides, else Fraction. Raises ZeroDivisionError
+    '''
+    if type(a) is int and type(b) is int and b and not a % b:
+        return a//b
+    return _exact(Fraction(a)/b)
+
+def _exact_pow(a,b):
+    '''
+    a^b exactly, for rational results only
+    Raises OverflowError if the result would need more than exact_bits bits,
+    ValueError if it is irrational (or a root of a negative), ZeroDivisionError for 0^-n
+    '''
+    a,p,q = Fraction(a),b.numerator,b.denominator
+    # Fractional exponent: take the exact q-th root first
+    if q > 1:
+        if a < 0 or q > exact_bits:
+            raise ValueError('Irrational Power')
+        a = Fraction(_iroot(a.numerator,q),_iroot(a.denominator,q))
+    if abs(a) != 1 and max(a.numerator.bit_length(),a.denominator.bit_length())*abs(p) > exact_bits:
+        raise OverflowError('Power Too Large')
+    return _exact(a**p)
+
+def _iroot(n,q):
+    '''
+    Exact integer q-th root of n >= 0, ValueError if there is none
+    '''
+    if n < 2:
+        return n
+    r = round(math.exp(math.log(n)/q))
+    for c in [r,r-1,r+1]:
+        if c**q == n:
+            return c
+    raise ValueError('Irrational Power')
+
+def _exact_term(n):
+    '''
+    n? exactly, for whole n >= 0. Bad termials raise ZeroDivisionError, as term does
+    '''
+    if type(n) is not int or n < 0:
+        raise ZeroDivisionError('Bad Termial')
+    return n*(n+1)//2
+
+# Same operations as op_func, in exact arithmetic: exact_func['/'](1,3) --> Fraction(1,3)
+# Irrational values like 6^(1/3) are refused, so (6^(1/3))^6 can only be found with floats
+# ints never leave the int fast path through + - *
+exact_func = {'+':lambda a,b: a+b if type(a) is int is type(b) else _exact(a+b),
+        '-':lambda a,b: a-b if type(a) is int is type(b) else _exact(a-b),
+        '*':lambda a,b: a*b if type(a) is int is type(b) else _exact(a*b),
+        '/':_exact_div,'^':_exact_pow,'!':lambda a: fact[a],'?':_exact_term}
+
 #########################################################################################
 # Scoring
 
+# "Inelegant" operations carry a penalty
+penalties = {'^':2,'!':5,'?':11}
+
 def score(expr):
     '''
     Return the score of an expression
@@ -45,8 +119,6 @@ def score(expr):
     Output:
     int. total of the penalties on the expression
     '''
-    # "Inelegant" operations carry a penalty
-    penalties = {'^':2,'!':5,'?':11}
     # Score an expression by summing its penalties
     return sum([penalties[t] if t in penalties else 0 for t in expr])
 
@@ -80,12 +152,13 @@ def eval_infix(expr):
         return bad_shunt
     return stack_calc(postfix)
 
-def evaluate(expr,mode='infix'):
+def evaluate(expr,mode='infix',exact=False):
     '''
     Safely Evaluate a given math expression
     Catch all possible exceptions and return error msgs
     Input:
     expr: string. the math expression input
+    exact: bool. if true, POSTFIX expressions are calculated exactly (see exact_func)
     Output:
     int. value of expression
 
@@ -97,7 +170,7 @@ def evaluate(expr,mode='infix'):
         if mode == 'infix':
             return eval_infix(expr)
         elif mode == 'postfix':
-            return stack_calc(expr)
+            return stack_calc(expr,exact=exact)
         else:
             print('Invalid Mode')
             exit()
@@ -123,12 +196,13 @@ def evaluate(expr,mode='infix'):
     except NameError:
         return 'Inf Division'
 
-def stack_calc(expr,save_stack=False):
+def stack_calc(expr,save_stack=False,exact=False):
     '''
     Evaluate a given math expression
     Input:
     expr: string. the math expression input
     save_stack: bool. if true, save everything pushed onto stack
+    exact: bool. if true, calculate with ints and fractions (see exact_func), not floats
     Output:
     int. value of expression
 
@@ -136,6 +210,8 @@ def stack_calc(expr,save_stack=False):
     POSTFIX notation, no spaces allowed
     ! is factorial, ? is termial, i.e. triangle numbers [n? = n+(n-1)?]
     '''
+    # Operations, see op_func and exact_func
+    funcs = exact_func if exact else op_func
     # Calculation Stack
     stack = []
     # Record of Intermediate Positions
@@ -152,13 +228,10 @@ def stack_calc(expr,save_stack=False):
             assert len(stack) >= n_operands[t], 'Invalid Expression'
             # Pop appropriate number of operands off stack
             curr_ops = [stack.pop() for i in range(n_operands[t])][::-1]
-            for i,o in enumerate(curr_ops):
-                ops[i] = o
-            # ops.update({i:stack.pop(-1*(i+1)) for i in range(n_operands[t])})
             # Evaluate operation and push back on stack
-            stack.append(calc[t]())
+            stack.append(funcs[t](*curr_ops))
             if save_stack:
-                record.append(calc[t]())
+                record.append(stack[-1])
     # At end of calculation, stack must have one element: the result
     assert len(stack) == 1, 'Invalid Expression'
     # Make sure no bad division has been done
@@ -167,6 +240,70 @@ def stack_calc(expr,save_stack=False):
         return int(stack[0]),record
     return int(stack[0])
 
+#########################################################################################
+# Batch Evaluator
+
+def to_codes(expr):
+    '''
+    Postfix expression as opcodes: '12+' --> b'\\x01\\x02\\x07'
+    '''
+    return bytes([opcodes[t] for t in expr])
+
+def evaluate_many(codes,exact=False):
+    '''
+    Evaluate many postfix expressions in one call
+    Bad operations are caught by checks up front, not by raising exceptions,
+    and nothing global is touched, so it can run in several threads at once
+    Input:
+    codes: iterable of bytes. postfix expressions as opcodes (see to_codes),
+        e.g. rows of a solutions store (see md_db)
+    exact: bool. if true, calculate with ints and fractions (see exact_func), not floats
+    Output:
+    (list,list). (values, error codes): value of each expression as int, None on error,
+        and 0 or what went wrong (see error_codes)
+    '''
+    funcs = exact_func if exact else op_func
+    # Opcode --> (number of operands, digit value or operation)
+    table = [None]+[(0,d) for d in range(1,7)]+[(n_operands[t],funcs[t]) for t in operators]
+    div,pw,fac,ter = [opcodes[t] for t in '/^!?']
+    values,errors = [],[]
+    for row in codes:
+        stack,err = [],0
+        for c in row:
+            k,f = table[c]
+            # Digit: push it
+            if not k:
+                stack.append(f)
+                continue
+            if len(stack) < k:
+                err = 1
+                break
+            x = stack[-k]
+            if c == fac and x not in fact:
+                err = 4
+            elif c == ter and not (x >= 0 and x % 1 == 0):
+                err = 3
+            elif c == div and not stack[-1]:
+                err = 2
+            # Powers overflow or leave the reals in too many ways to check up front
+            elif c == pw:
+                try:
+                    stack[-2:] = [f(x,stack[-1])]
+                except calc_errors as e:
+                    err = 5 if type(e) is OverflowError else 6
+            else:
+                stack[-k:] = [f(*stack[-k:])]
+            if err:
+                break
+        if not err and len(stack) != 1:
+            err = 1
+        # Whole numbers only (inf and nan fail this too)
+        if not err and stack[0] % 1 != 0:
+            err = 7
+        values.append(None if err else int(stack[0]))
+        errors.append(err)
+    return values,errors
+
 #########################################################################################
 # Postfix to Infix Conversion
 
@@ -183,24 +320,10 @@ def to_infix(expr,mode='smart'):
     POSTFIX notation, no spaces allowed
     ! is factorial, ? is termial, i.e. triangle numbers [n? = n+(n-1)?]
     '''
-    # Calculation Stack
-    stack = []
-    for t in expr:
-        # If t is a number, push it
-        if t.isdigit():
-            stack.append(t)
-        # Else t is an operator
-        else:
-            # Make sure operator has enough operands
-            assert len(stack) >= n_operands[t], 'Invalid Expression'
-            # Pop appropriate number of operands off stack
-            curr_ops = [stack.pop() for i in range(n_operands[t])][::-1]
-            # Format new expression and push back on stack
-            stack.append(infix[t].format(*parenthesize(curr_ops,t,mode)))
-    # At end of calculation, stack must have one element: the result
-    assert len(stack) == 1, 'Invalid Expression'
+    assert mode in ['smart','full','normal'], 'Invalid Mode'
     # In full mode, enclose whole expression in parends
-    return f'({stack[0]})' if mode == 'full' else stack[0]
+    return f'({node_infix(to_node(expr),mode)})' if mode == 'full' else\
+            node_infix(to_node(expr),mode)
 
 def parenthesize(operands,operator,mode='smart'):
     '''
@@ -212,53 +335,58 @@ def parenthesize(operands,operator,mode='smart'):
     list of str. operands appropriately parenthesized
     '''
     assert mode in ['smart','full','normal'], 'Invalid Mode'
-    return eval(f'parenthesize_{mode}(operands,operator)')
+    return parenthesizers[mode](operands,operator)
 
 def parenthesize_multi(operands,operator,mode='smart'):
     assert mode in ['smart','normal'], 'Invalid Mode'
-    return eval(f'parenthesize_{mode}_multi(operands,operator)')
+    return multi_parenthesizers[mode](operands,operator)
+
+def outside_parends(s):
+    '''
+    Tokens of an infix string outside all parends, in one pass: '2*(3+4)!' --> 2*!
+    Input:
+    s: str. infix expression
+    Output:
+    list of str. tokens at parend depth 0, parends themselves dropped
+    '''
+    depth,out = 0,[]
+    for t in s:
+        depth += (t == '(')-(t == ')')
+        if not depth and t not in '()':
+            out.append(t)
+    return out
+
+def _min_precedence(s):
+    '''
+    Lowest precedence of the tokens of an infix string outside parends, 999 if none
+    '''
+    return min([infix_precedence[t] for t in outside_parends(s)],default=999)
 
 def parenthesize_smart(operands,operator):
     '''
     Smart parends - only parenthesize when needed
     '''
-    # Test if string has balanced parentheses
-    balanced = lambda s: s.count('(') == s.count(')')
-    # Remove all parends and expressions inside parends, get precedence of remaining
-    rm_parends = lambda s: [t for (i,t) in enumerate(s)\
-            if balanced(s[:i+1]) and t not in '()']
-    # Take minimum of precedence list, returning high precedence if empty
-    am = lambda s: min(rm_parends(s),key=lambda t: infix_precedence[t])\
-            if rm_parends(s) else None
-    m = lambda s: infix_precedence[am(s)] if am(s) else 999
+    prec = infix_precedence[operator]
     # Expression needs to be in parends if...
     # (a) its min unparenthesized precedence is less than operator precedence - OR -
     # (b) its MUP equals operator precedence AND 
     #   (1) its MUO equals operator but it lacks the correct associativity OR
     #   (2) its MUO doesn't equal operator and operator lacks correct associativity
-    p = lambda i,o: m(o) < infix_precedence[operator] or\
-            m(o) == infix_precedence[operator] and\
-            (am(o) == operator and 'LR'[i] not in associativity[am(o)] or\
-            am(o) != operator and 'LR'[i] not in associativity[operator])
+    # Either way, (b) comes down to the operator's associativity
+    def p(i,o):
+        m = _min_precedence(o)
+        return m < prec or m == prec and 'LR'[i] not in associativity[operator]
     return [f'({o})' if p(i,o) else o for i,o in enumerate(operands)]
 
 def parenthesize_smart_multi(operands,operator):
     '''
     Smart parends for longer exprs of all + or all * for normalizer
     '''
-    # Test if string has balanced parentheses
-    balanced = lambda s: s.count('(') == s.count(')')
-    # Remove all parends and expressions inside parends, get precedence of remaining
-    rm_parends = lambda s: [t for (i,t) in enumerate(s)\
-            if balanced(s[:i+1]) and t not in '()']
-    # Take minimum of precedence list, returning high precedence if empty
-    am = lambda s: min(rm_parends(s),key=lambda t: infix_precedence[t])\
-            if rm_parends(s) else None
-    m = lambda s: infix_precedence[am(s)] if am(s) else 999
     # Expression needs to be in parends if
     # its min unparenthesized precedence is less than operator precedence
     # other cases will not occur as the only possible operators are +*
-    return [f'({o})' if m(o) < infix_precedence[operator] else o for o in operands]
+    prec = infix_precedence[operator]
+    return [f'({o})' if _min_precedence(o) < prec else o for o in operands]
 
 def parenthesize_normal(operands,operator):
     '''
@@ -267,14 +395,14 @@ def parenthesize_normal(operands,operator):
     - Unary ops or digits or other unary ops
     - Multiple +s or *s
     '''
-    # Test if string has balanced parentheses
-    balanced = lambda s: s.count('(') == s.count(')')
-    # Remove all parends and expressions inside parends, and all digits and unary ops
-    rm_pd = lambda s: [t for (i,t) in enumerate(s) if balanced(s[:i+1]) and t in '+-*/^!?']
+    # Operators outside parends (digits dropped)
+    ops = lambda s: [t for t in outside_parends(s) if t in operators]
     # Don't Parenthesize when 
-    # rm_pdu is empty (only digits & unary ops or already in parends)
+    # there are none (only digits or already in parends)
     # Or when all ops in operand as well as operator are the same an in + or *
-    p = lambda o: not rm_pd(o) or operator in '+*' and all(t==operator for t in rm_pd(o))
+    def p(o):
+        ts = ops(o)
+        return not ts or operator in '+*' and all(t==operator for t in ts)
     return [f'({o})' if not p(o) else o for o in operands]
 
 def parenthesize_normal_multi(operands,operator):
@@ -286,6 +414,105 @@ def parenthesize_full(operands,operator):
     '''
     return [f'({o})' for o in operands]
 
+# Parenthesizer for each mode
+parenthesizers = {'smart':parenthesize_smart,'normal':parenthesize_normal,\
+        'full':parenthesize_full}
+multi_parenthesizers = {'smart':parenthesize_smart_multi,'normal':parenthesize_normal_multi}
+
+#########################################################################################
+# Expression Nodes
+
+# Size of each node cache: distinct subtrees kept before the least recently used go
+node_cache = 1<<20
+
+@lru_cache(maxsize=node_cache)
+def node(t,*operands):
+    '''
+    Interned expression node: each distinct subtree is built once and shared,
+    so everything cached per node (infix, score) is worked out once.
+    Used by the parser and humanizer; the solver works on postfix strings and its own
+    value tables
+    node('+',node('1'),node('2')) --> ('+',(('1',()),('2',())))
+    Input:
+    t: str. digit or operator
+    operands: nodes. operands of t, none for a digit.
+        + and * take any number >= 2 (flattened chains, as in md_humanizer)
+    Output:
+    tuple. (token,operand nodes)
+    '''
+    return t,operands
+
+def to_node(expr):
+    '''
+    Expression node of a postfix expression
+    Input:
+    expr: str or list of str. postfix expression
+    Output:
+    tuple. root node (see node)
+    '''
+    stack = []
+    for t in expr:
+        # If t is a number, push it
+        if t.isdigit():
+            stack.append(node(t))
+        # Else t is an operator: make sure it has enough operands and apply it
+        else:
+            assert len(stack) >= n_operands[t], 'Invalid Expression'
+            k = n_operands[t]
+            stack[-k:] = [node(t,*stack[-k:])]
+    # At end, stack must have one element: the whole expression
+    assert len(stack) == 1, 'Invalid Expression'
+    return stack[0]
+
+@lru_cache(maxsize=node_cache)
+def node_score(n):
+    '''
+    Score of an expression node (see score)
+    '''
+    t,operands = n
+    return penalties.get(t,0)*max(1,len(operands)-1)+sum([node_score(o) for o in operands])
+
+def node_infix(n,mode='smart'):
+    '''
+    Infix of an expression node, parenthesized as in parenthesize (no enclosing parends)
+    Input:
+    n: tuple. expression node
+    mode: str. parenthesizing mode: smart, normal or full
+    Output:
+    str. expression as infix
+    '''
+    return _node_infix(n,mode)[0]
+
+@lru_cache(maxsize=node_cache)
+def _node_infix(n,mode):
+    '''
+    Infix of an expression node, with what its parent needs to parenthesize it
+    Same parends as parenthesize_smart(_multi), parenthesize_normal, parenthesize_full,
+    worked out from the operands' precedence instead of rescanning their strings
+    Output:
+    (str,int). (infix, lowest precedence outside parends)
+    '''
+    t,operands = n
+    if not operands:
+        return t,999
+    prec = infix_precedence[t]
+    rs = [_node_infix(o,mode) for o in operands]
+    # Which operands need parends?
+    # smart: lowest unparenthesized precedence is less than operator's, or the same and
+    #   operator lacks the associativity (only 1 or 2 operands, see parenthesize_smart_multi)
+    # normal: anything but digits and continuations of a + or * chain
+    # full: everything
+    if mode == 'smart':
+        ps = [m < prec or m == prec and len(rs) < 3 and 'LR'[i] not in associativity[t]\
+                for i,(s,m) in enumerate(rs)]
+    elif mode == 'normal':
+        ps = [o[1] and not (t in '+*' and o[0] == t) for o in operands]
+    else:
+        ps = [True]*len(rs)
+    parts = [f'({s})' if p else s for (s,m),p in zip(rs,ps)]
+    m = min([prec]+[m for (s,m),p in zip(rs,ps) if not p])
+    return (parts[0]+t if len(parts) == 1 else t.join(parts)),m
+
 #########################################################################################
 # Shunting-Yard Algorithm
 
@@ -350,6 +577,27 @@ def shunt(tokens):
 # Main Code
 
 if __name__ == '__main__':
+    import sys
+    # Benchmark: batch evaluator vs stack_calc over the full expression space
+    # python3 md_parser.py bench [white dice] [n_unary], e.g. bench 1236 1
+    if sys.argv[1:2] == ['bench']:
+        import time
+        import md_solver as ms
+        w_dice = tuple(int(d) for d in (sys.argv[2] if len(sys.argv) > 2 else '1236'))
+        n_unary = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+        exprs = list(ms.gen_valid_exprs(w_dice,n_unary))
+        codes = [to_codes(e) for e in exprs]
+        t = time.perf_counter()
+        for e in exprs:
+            evaluate(e,mode='postfix')
+        t = time.perf_counter()-t
+        print(f'{len(exprs)} expressions, {ms._w_str(w_dice)} with {n_unary} unary')
+        print(f'{"evaluate":14} {t:8.2f}s {1e6*t/len(exprs):8.2f}us/expr')
+        t = time.perf_counter()
+        evaluate_many(codes)
+        t = time.perf_counter()-t
+        print(f'{"evaluate_many":14} {t:8.2f}s {1e6*t/len(exprs):8.2f}us/expr')
+        exit()
     # Evaluate User Input Expressions, Return to exit
     print('Math Dice Parser: Press [Return] to Exit')
     while expr := input('Enter Expression: '):
@@ -0,0 +1,232 @@
+# Math Dice Profiling
+# Off-by-default stage timers and search counters for the solver, parser and humanizer
+# Skye Rhomberg
+
+import time
+import inspect
+import cProfile
+import importlib
+from functools import wraps
+from contextlib import contextmanager
+from collections import Counter
+
+#########################################################################################
+# Configuration
+# Nothing is instrumented until enable(): the functions below are then swapped for timing
+# wrappers in their modules, and swapped back by disable(). Only a few per-combo checks
+# of enabled stay in the code, so profiling off costs next to nothing
+
+# Stage: functions timed under it, as (module, function)
+# Times are inclusive (a search's time includes the operations and scoring done in it),
+# and a stage nested in itself (e.g. evaluate calling stack_calc) is timed once
+stages = {
+    'search':[('md_solver','gen_valid_values'),('md_solver','best_solutions'),\
+            ('md_solver','dp_solutions'),('md_solver','dp_levels'),\
+            ('md_solver','_dp_level'),('md_solver','vector_solutions')],
+    'evaluate':[('md_parser','evaluate'),('md_parser','stack_calc'),\
+            ('md_parser','evaluate_many')],
+    'score':[('md_parser','score')],
+    'humanize':[('md_humanizer','humanize'),('md_humanizer','normalize')],
+    'infix':[('md_parser','to_infix')],
+    'read':[('md_db','get_sols'),('md_db','get_humanized'),('md_db','load_sols')],
+    'write':[('md_solver','_write_combo'),('md_db','write_db')],
+}
+# Stage timing every single operator applied by the searches (md_parser.op_func and
+# exact_func), counting the exceptions they raise by type. Timing each one is costly,
+# so this stage inflates search times more than the others
+op_stage = 'operate'
+
+# Is profiling on
+enabled = False
+# Stage: number of (outermost) calls
+calls = Counter()
+# Stage: total seconds
+seconds = Counter()
+# Search counts (see md_solver.gen_valid_values), solutions kept, exceptions raised
+counters = Counter()
+# Stage: depth of calls in progress, so nested calls aren't timed twice
+_depth = Counter()
+# (container, key, original) of every function swapped out by enable
+_saved = []
+
+#########################################################################################
+# Switching On and Off
+
+def enable(ops=True):
+    '''
+    Start profiling: reset the counts and instrument every stage
+    Input:
+    ops: bool. if true, also time every operator applied (see op_stage)
+    '''
+    global enabled
+    if enabled:
+        disable()
+    reset()
+    for name,fs in stages.items():
+        for m,f in fs:
+            m = importlib.import_module(m)
+            _swap(vars(m),f,_timer(name,getattr(m,f)))
+    if ops:
+        mp = importlib.import_module('md_parser')
+        for funcs in [mp.op_func,mp.exact_func]:
+            for t,f in list(funcs.items()):
+                _swap(funcs,t,_op_timer(f))
+    enabled = True
+
+def disable():
+    '''
+    Stop profiling: put back every instrumented function. Counts are kept
+    '''
+    global enabled
+    while _saved:
+        container,key,f = _saved.pop()
+        container[key] = f
+    enabled = False
+
+def reset():
+    '''
+    Clear all timers and counters
+    '''
+    for c in [calls,seconds,counters,_depth]:
+        c.clear()
+
+def run(f,*args,dump=None,ops=True,**kwargs):
+    '''
+    Call a function with profiling on
+    Input:
+    f: function. to call with args and kwargs
+    dump: str. if given, also run it under cProfile and write the stats here
+        (read with pstats, snakeviz...)
+    ops: bool. see enable
+    Output:
+    result of f
+    '''
+    enable(ops)
+    prof = cProfile.Profile() if dump else None
+    try:
+        return prof.runcall(f,*args,**kwargs) if prof else f(*args,**kwargs)
+    finally:
+        disable()
+        if prof:
+            prof.dump_stats(dump)
+
+#########################################################################################
+# Hooks
+# Called from the instrumented code, cheap when profiling is off
+
+def tally(stats,solutions=0):
+    '''
+    Add one finished search's counts
+    Input:
+    stats: Counter. node and prune counts (see md_solver.gen_valid_values)
+    solutions: int. number of solutions kept
+    '''
+    if enabled:
+        counters.update(stats)
+        counters['solutions kept'] += solutions
+
+@contextmanager
+def stage(name):
+    '''
+    Time a block of code under a stage: with stage('write'): ...
+    '''
+    if not enabled:
+        yield
+        return
+    start = _enter(name)
+    try:
+        yield
+    finally:
+        _exit(name,start)
+
+#########################################################################################
+# Report
+
+def report(total=None):
+    '''
+    Format stage timers and counters
+    Input:
+    total: float. if given, wall seconds of the whole run, to show each stage's share
+    Output:
+    str. one line per stage, then the counters
+    '''
+    fmt = lambda k: f'{k:10} {calls[k]:>10} {seconds[k]:10.3f}s'+\
+            (f' {100*seconds[k]/total:6.1f}%' if total else '')
+    head = [f'{"stage":10} {"calls":>10} {"time":>11}'+(f' {"share":>7}' if total else '')]
+    lines = head+[fmt(k) for k in sorted(seconds,key=seconds.get,reverse=True)]
+    counts = ', '.join([f'{k} {v}' for k,v in sorted(counters.items())])
+    return '\n'.join(([f'total {total:.3f}s'] if total else [])+lines+\
+            [f'counts: {counts or "none"}'])
+
+#########################################################################################
+# Instrumenting
+
+def _swap(container,key,f):
+    '''
+    Replace container[key] by f, saving the original for disable
+    '''
+    _saved.append((container,key,container[key]))
+    container[key] = f
+
+def _enter(name):
+    '''
+    Start timing a stage call. Output: float. start time, or None if nested
+    '''
+    _depth[name] += 1
+    return time.perf_counter() if _depth[name] == 1 else None
+
+def _exit(name,start):
+    '''
+    Stop timing a stage call started by _enter
+    '''
+    _depth[name] -= 1
+    if start is not None:
+        seconds[name] += time.perf_counter()-start
+        calls[name] += 1
+
+def _timer(name,f):
+    '''
+    Wrap f to time its calls under a stage. Generators are timed while they run
+    '''
+    if inspect.isgeneratorfunction(f):
+        @wraps(f)
+        def timed_gen(*args,**kwargs):
+            g,first = f(*args,**kwargs),True
+            while True:
+                start = _enter(name)
+                try:
+                    x = next(g)
+                except StopIteration:
+                    return
+                finally:
+                    _depth[name] -= 1
+                    if start is not None:
+                        seconds[name] += time.perf_counter()-start
+                        calls[name] += first
+                    first = False
+                yield x
+        return timed_gen
+    @wraps(f)
+    def timed(*args,**kwargs):
+        start = _enter(name)
+        try:
+            return f(*args,**kwargs)
+        finally:
+            _exit(name,start)
+    return timed
+
+def _op_timer(f):
+    '''
+    Wrap an operator to time it under op_stage and count what it raises
+    '''
+    def timed_op(*ops):
+        start = time.perf_counter()
+        try:
+            return f(*ops)
+        except Exception as err:
+            counters[f'raised {type(err).__name__}'] += 1
+            raise
+        finally:
+            seconds[op_stage] += time.perf_counter()-start
+            calls[op_stage] += 1
+    return timed_op
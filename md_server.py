@@ -0,0 +1,209 @@
+# Math Dice Solver Service
+# Answer solve/analyze/unsolvable queries over a local socket, with the solutions db and
+# the solver caches kept warm between queries
+# Skye Rhomberg
+
+import asyncio
+import json
+import signal
+import socket
+import os
+import md_solver as ms
+import md_db as db
+import md_grade as gr
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import suppress
+
+#########################################################################################
+# Protocol
+# One JSON object per line, each way. Requests on a connection are answered as they
+# finish, not in order: tag them with an id to match them up
+#   request: {"id": any, "op": "solve", "w_dice": 12345, "b_dice": 24, "just_best": true}
+#   response: {"id": same, "ok": true, "result": ...}
+#       or {"id": same, "ok": false, "error": "KeyError: 'b_dice'"}
+# Ops and their arguments (see the handlers below):
+#   solve: w_dice, b_dice, just_best=false --> [[[normalized,score],[equivalents]],...]
+#   analyze: w_dice, b_dice, solution (infix) --> {value, correct, wrong_dice, score,
+#       normalized, best_score, optimal, error, alternatives}. value is null and error
+#       says why for a solution that doesn't evaluate (e.g. dividing by zero)
+#   unsolvable: w_dice, max_unary=6 --> [black totals]
+#   min_unary: w_dice, b_dice, max_unary=6 --> int or null
+#   ping --> "pong"
+
+def query(address,**request):
+    '''
+    Send one request to a running service and wait for the answer
+    Input:
+    address: str. unix socket path, or host:port
+    request: op and its arguments (see Protocol)
+    Output:
+    result of the request
+    '''
+    with _connect(address) as sock:
+        sock.sendall((json.dumps(request)+'\n').encode())
+        resp = json.loads(sock.makefile('rb').readline())
+    if not resp['ok']:
+        raise RuntimeError(resp['error'])
+    return resp['result']
+
+def _connect(address):
+    '''
+    Open a client socket to a service address (see query)
+    '''
+    if ':' in address:
+        host,port = address.rsplit(':',1)
+        return socket.create_connection((host,int(port)))
+    sock = socket.socket(socket.AF_UNIX)
+    sock.connect(address)
+    return sock
+
+#########################################################################################
+# Handlers
+# Each takes the db name and the request, and returns a JSON-able result
+
+def _solve(db_name,req):
+    '''
+    Humanized solutions (see md_solver.get_humanized)
+    '''
+    return ms.get_humanized(_w(req),req['b_dice'],db_name,req.get('just_best',False))
+
+def _analyze(db_name,req):
+    '''
+    Check a solution: value, correctness, score, normalized form, and how it compares
+    to the best solutions (see md_grade.grade)
+    '''
+    w_dice,b_dice = _w(req),req['b_dice']
+    g = gr.grade(w_dice,b_dice,req['solution'],db_name)
+    hs = ms.get_humanized(w_dice,b_dice,db_name,True)
+    return {**{k:g[k] for k in ['value','correct','wrong_dice','score','normalized',\
+            'best_score','optimal','error']},\
+            'alternatives':[e for ((e,s),l) in hs if e != g['normalized']]}
+
+def _unsolvable(db_name,req):
+    '''
+    Unsolvable black totals (see md_solver.unsolvable), from the db's index if there is one
+    '''
+    return ms.unsolvable(_w(req),_db_or_none(db_name),req.get('max_unary',6))
+
+def _min_unary(db_name,req):
+    '''
+    Fewest unaries needed (see md_solver.min_unary), from the db's index if there is one
+    '''
+    return ms.min_unary(_w(req),req['b_dice'],req.get('max_unary',6),_db_or_none(db_name))
+
+handlers = {'solve':_solve,'analyze':_analyze,'unsolvable':_unsolvable,\
+        'min_unary':_min_unary,'ping':lambda db_name,req: 'pong'}
+
+def _w(req):
+    '''
+    White dice of a request, given as 12345 or [1,2,3,4,5], as a sorted tuple
+    '''
+    w = req['w_dice']
+    return tuple(sorted([int(d) for d in (str(w) if type(w) is int else w)]))
+
+def _db_or_none(db_name):
+    '''
+    db_name if there is such a db, else None (answer from the value tables)
+    '''
+    return db_name if db.is_db(db_name) or os.path.isdir(db_name) else None
+
+def _answer(db_name,live_dir,req):
+    '''
+    Answer one request. Runs in the server or in a worker process
+    Input:
+    db_name: str. solutions db (see md_solver.get_sols)
+    live_dir: str. on-demand solutions cache (see md_solver.live_sols)
+    req: dict. request
+    Output:
+    JSON-able result
+    '''
+    ms.live_dir = live_dir
+    return handlers[req['op']](db_name,req)
+
+def _fast(db_name,req):
+    '''
+    Whether a request can be answered right away, without blocking other clients:
+    pings, and small lookups in a single-file store: its index, or the best humanized
+    solutions (for analyze and best-only solve). Full solves unpickle and send every
+    solution, which can take a while on large configs, so they go to the workers
+    '''
+    if req.get('op') not in handlers or req['op'] == 'ping':
+        return True
+    if not db.is_db(db_name):
+        return False
+    if req['op'] in ['unsolvable','min_unary']:
+        return True
+    best = req['op'] == 'analyze' or req['op'] == 'solve' and req.get('just_best',False)
+    return best and db.has_humanized(db_name)
+
+#########################################################################################
+# Server
+
+def serve(address,db_name,jobs=2,live_dir=None):
+    '''
+    Run the service until interrupted or terminated, then remove its unix socket
+    Fast requests (see _fast) are answered in the server itself, the rest in a pool of
+    worker processes, which keep their own caches warm between requests
+    Input:
+    address: str. unix socket path, or host:port
+    db_name: str. solutions db (see md_solver.get_sols). If missing, solved on demand
+    jobs: int. number of worker processes for slow requests
+    live_dir: str. on-demand solutions cache (see md_solver.live_sols)
+    '''
+    try:
+        asyncio.run(_serve(address,db_name,jobs,live_dir))
+    except (KeyboardInterrupt,asyncio.CancelledError):
+        pass
+    finally:
+        if ':' not in address and os.path.exists(address):
+            os.unlink(address)
+
+async def _serve(address,db_name,jobs,live_dir):
+    '''
+    Asynchronous body of serve
+    '''
+    # Terminating cancels the server, so serve can clean up
+    with suppress(NotImplementedError):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM,\
+                asyncio.current_task().cancel)
+    with ProcessPoolExecutor(jobs) as pool:
+        client = lambda r,w: _client(r,w,db_name,live_dir,pool)
+        if ':' in address:
+            host,port = address.rsplit(':',1)
+            server = await asyncio.start_server(client,host,int(port))
+        else:
+            server = await asyncio.start_unix_server(client,address)
+        async with server:
+            await server.serve_forever()
+
+async def _client(reader,writer,db_name,live_dir,pool):
+    '''
+    Serve one connection: every request line is answered concurrently
+    '''
+    lock,tasks = asyncio.Lock(),set()
+    while line := await reader.readline():
+        task = asyncio.create_task(_respond(line,writer,lock,db_name,live_dir,pool))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    await asyncio.gather(*tasks)
+    writer.close()
+
+async def _respond(line,writer,lock,db_name,live_dir,pool):
+    '''
+    Answer one request line and write the response
+    '''
+    req = {}
+    try:
+        req = json.loads(line)
+        if _fast(db_name,req):
+            result = _answer(db_name,live_dir,req)
+        else:
+            result = await asyncio.get_running_loop().run_in_executor(pool,_answer,\
+                    db_name,live_dir,req)
+        resp = {'id':req.get('id'),'ok':True,'result':result}
+    except Exception as err:
+        resp = {'id':req.get('id') if type(req) is dict else None,'ok':False,\
+                'error':f'{type(err).__name__}: {err}'}
+    async with lock:
+        writer.write((json.dumps(resp)+'\n').encode())
+        await writer.drain()
@@ -3,10 +3,22 @@
 
 import itertools as it
 import md_parser as mp
+import md_humanizer as mh
+import md_db as db
+import md_profile as prof
 import pickle as pkl
 import sys
-import subprocess
 import os
+import time
+import json
+from multiprocessing import Pool
+from collections import Counter
+from functools import lru_cache
+# Optional: vectorized template evaluation (see vector_solutions)
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 # Binary (PEMDAS) ops
 pemdas_ops = ['+','-','*','/','^']
@@ -21,7 +33,7 @@ valid_ans = sum([[10*(i + 1) + j + 1 for j in range(6)] for i in range(6)],[])
 #########################################################################################
 # Generate Valid Expressions
 
-def gen_valid_exprs(w_dice,n_unary=0):
+def gen_valid_exprs(w_dice,n_unary=0,canonical=False):
     '''
     Generate All Valid Expressions
     For a given configuration of the dice
@@ -29,10 +41,12 @@ def gen_valid_exprs(w_dice,n_unary=0):
     Input:
     w_dice: 5-tuple of int. given white dice configuration
     n_unary: int. number of unary operators (!,?) allowable
+    canonical: bool. if true, only one spelling per reordering of + and * chains
+        (see _canon_push). if false, all spellings
     Output:
     generator of str. valid postfix expressions using each white die exactly once
     '''
-    yield from _gen_expr('',[d for d in w_dice],n_unary,0)
+    yield from _gen_expr('',[d for d in w_dice],n_unary,0,() if canonical else None)
 
 def _next_valid(dice_left,stack_size,n_unary=0):
     '''
@@ -57,7 +71,7 @@ def _rm_die(dice_left,n):
     '''
     return [d for d in dice_left if d != n] + [n] * (dice_left.count(n) - 1)
 
-def _gen_expr(expr,dice_left,n_unary,stack_size):
+def _gen_expr(expr,dice_left,n_unary,stack_size,shapes=None):
     '''
     Recursively generate valid expression given partial expression
     and add it to list of valid expressions
@@ -66,6 +80,7 @@ def _gen_expr(expr,dice_left,n_unary,stack_size):
     dice_left: list of int. white dice still unused
     n_unary: int. number of unary operators (!,?) allowable
     stack_size: simulated calc stack size for expr
+    shapes: tuple or None. stack shapes for canonical enumeration, None for all spellings
     generator of next recursion level of partial expressions
     '''
     # Base Case: All digits and unaries used and stack size 1, i.e. result calculated
@@ -79,49 +94,801 @@ def _gen_expr(expr,dice_left,n_unary,stack_size):
         s = op_change[t]
         # 1 if unary, 0 if not
         n = t in unary_ops
+        # Skip non-canonical spellings
+        if shapes is not None and (sh := _canon_push(shapes,expr,t)) is None:
+            continue
         # Recurse with new token
-        yield from _gen_expr(expr+str(t),_rm_die(dice_left,t),n_unary-n,stack_size+s)
+        yield from _gen_expr(expr+str(t),_rm_die(dice_left,t),n_unary-n,stack_size+s,\
+                sh if shapes is not None else None)
+
+def _canon_push(shapes,expr,t):
+    '''
+    Shape of the calc stack after pushing token t onto expr, for canonical enumeration
+    Normal-form rules as in md_humanizer.sort_commute:
+    + and * chains are flattened (built left-deep, a+b+c never a+(b+c))
+    and their operands sorted shortest first, ties broken by lexicography
+    Input:
+    shapes: tuple. one entry per calc stack entry of expr:
+        (top operator or None, infix tokens w/o parends, start index in expr,
+        sort key of last operand if a + or * chain)
+    expr: str. partially generated expression
+    t: int or str. next token
+    Output:
+    tuple or None. new shapes, None if t makes a non-canonical spelling
+    '''
+    # Digit: new one-token entry
+    if t not in mp.op_func:
+        return shapes+((None,str(t),len(expr),None),)
+    # Unary: wrap top entry
+    if mp.n_operands[t] == 1:
+        op,flat,start,last = shapes[-1]
+        return shapes[:-1]+((t,flat+t,start,None),)
+    (a_op,a_flat,a_start,a_last),(b_op,b_flat,b_start,b_last) = shapes[-2:]
+    last = None
+    if t in '+*':
+        # Sort key: length, then infix tokens, then postfix to break remaining ties
+        key = lambda flat,start,end: (len(flat),flat,expr[start:end])
+        last = key(b_flat,b_start,len(expr))
+        # Right operand can't continue the chain, operands must be in order
+        if b_op == t or (a_last if a_op == t else key(a_flat,a_start,b_start)) > last:
+            return None
+    return shapes[:-2]+((t,a_flat+t+b_flat,a_start,last),)
+
+#########################################################################################
+# Incremental Evaluation
+
+def gen_valid_values(w_dice,n_unary=0,targets=None,stats=None,canonical=False,exact=False,\
+        tick=None):
+    '''
+    Generate All Valid Expressions along with their values
+    The partially evaluated calc stack is carried down the recursion,
+    so each token is applied exactly once per node of the search tree
+    Input:
+    w_dice: 5-tuple of int. given white dice configuration
+    n_unary: int. number of unary operators (!,?) allowable
+    targets: set of int. if given, prune branches that can't reach any of these values
+    stats: Counter. if given, count nodes expanded, expressions evaluated,
+        and pruned nodes by reason (see _prune_reason)
+    canonical: bool. if true, only one spelling per reordering of + and * chains.
+        Implies exact: float + and * aren't associative, so a dropped reordering could
+        round to a whole number the kept one misses
+    exact: bool. if true, calculate with ints and fractions (see md_parser.exact_func),
+        so values are compared exactly; else with floats
+    tick: function. if given, called with the partial expression every progress_check
+        nodes, so progress can be reported even when no solutions are found
+    Output:
+    generator of (str,number). (valid postfix expression, value of expression)
+    '''
+    stats = stats if stats is not None else Counter()
+    yield from _gen_eval('',[d for d in w_dice],n_unary,(),targets,stats,\
+            () if canonical else None,exact or canonical,tick)
+
+def _gen_eval(expr,dice_left,n_unary,stack,targets,stats,shapes=None,exact=False,tick=None):
+    '''
+    Recursively generate valid expressions and their values given partial expression
+    Branches whose operation fails (zero division, bad factorial, overflow...) are dropped
+    Input:
+    expr: str. partially generated expression
+    dice_left: list of int. white dice still unused
+    n_unary: int. number of unary operators (!,?) allowable
+    stack: tuple. calc stack of expr, evaluated so far
+    targets: set of int or None. values worth reaching
+    stats: Counter. node and prune counts
+    shapes: tuple or None. stack shapes for canonical enumeration, None for all spellings
+    exact: bool. if true, exact arithmetic, else floats
+    tick: function or None. progress callback (see gen_valid_values)
+    Output:
+    generator of (str,number). next recursion level of partial expressions
+    '''
+    funcs = mp.exact_func if exact else mp.op_func
+    stats['nodes'] += 1
+    if tick is not None and not stats['nodes'] % progress_check:
+        tick(expr)
+    # Base Case: All digits and unaries used and stack size 1, i.e. result calculated
+    if not dice_left and not n_unary and len(stack) == 1:
+        stats['evaluated'] += 1
+        yield expr,stack[0]
+    # For each valid next token
+    for t in _next_valid(dice_left,len(stack),n_unary):
+        # Skip non-canonical spellings
+        if shapes is not None and (sh := _canon_push(shapes,expr,t)) is None:
+            stats['non-canonical'] += 1
+            continue
+        # Number: push it
+        if t not in mp.op_func:
+            s = stack+(t,)
+        # Operator: pop operands, apply, push result -- or drop the whole branch
+        else:
+            k = mp.n_operands[t]
+            try:
+                s = stack[:-k]+(funcs[t](*stack[-k:]),)
+            except mp.calc_errors as err:
+                stats[_prune_reason(t,err)] += 1
+                continue
+        d, u = _rm_die(dice_left,t), n_unary-(t in unary_ops)
+        # Only unaries left to apply: value on the stack must be able to hit a target
+        if targets is not None and not d and len(s) == 1 and\
+                targets.isdisjoint(_unary_reach(s[0],u,exact)):
+            stats['unreachable' if u else 'off target'] += 1
+            continue
+        # Recurse with new token
+        yield from _gen_eval(expr+str(t),d,u,s,targets,stats,\
+                sh if shapes is not None else None,exact,tick)
+
+def _prune_reason(t,err):
+    '''
+    Name the reason an operation failed, for prune counts
+    Input:
+    t: str. operator applied
+    err: Exception. raised by the operation
+    Output:
+    str. 'bad factorial', 'bad termial', 'zero division', 'overflow' or 'domain'
+    '''
+    if t in unary_ops:
+        return {'!':'bad factorial','?':'bad termial'}[t]
+    return {ZeroDivisionError:'zero division',OverflowError:'overflow'}.get(type(err),'domain')
+
+@lru_cache(maxsize=1<<16)
+def _unary_reach(value,n_unary,exact=False):
+    '''
+    Whole numbers reachable from value by applying exactly n_unary unary operators
+    Input:
+    value: number. value on calc stack
+    n_unary: int. number of unary operators (!,?) still to apply
+    exact: bool. if true, exact arithmetic, else floats
+    Output:
+    frozenset of int. reachable results
+    '''
+    if not n_unary:
+        return frozenset([_int_result(value)])-{None}
+    reach = frozenset()
+    for t in unary_ops:
+        try:
+            reach |= _unary_reach((mp.exact_func if exact else mp.op_func)[t](value),\
+                    n_unary-1,exact)
+        except mp.calc_errors:
+            pass
+    return reach
+
+def _int_result(value):
+    '''
+    Whole-number result of a calculation, as checked at the end of md_parser.stack_calc
+    Input:
+    value: number. value left on the calc stack
+    Output:
+    int or None. value as int, None if it is not a whole number
+    '''
+    try:
+        return int(value) if value == int(value) else None
+    # inf or nan
+    except (OverflowError,ValueError):
+        return None
 
 #########################################################################################
 # Generate Valid Solutions
 
-def gen_valid_solutions(w_dice,b_dice=None,n_unary=0,verbose=False):
+def gen_valid_solutions(w_dice,b_dice=None,n_unary=0,verbose=False,stats=None,\
+        canonical=False,exact=False,log=None):
     '''
     Generate and score valid math dice solutions for a given set of white dice
     Valid solutions evaluate to whole numbers reachable with the black dice,
     i.e. 11-16,21-26,...,61-66
     Input:
     w_dice: 5-tuple of int. white dice combination
+    b_dice: list of int. black dice totals to solve for. If none, defaults to all
     n_unary: int. number of unary operators (!,?) allowable
-    verbose: bool. verbose mode
+    verbose: bool. verbose mode: progress line (see _reporter), then search counts
+    stats: Counter. if given, filled with search node and prune counts
+    canonical: bool. if true, only one spelling per reordering of + and * chains (implies exact)
+    exact: bool. if true, exact arithmetic (see gen_valid_values), else floats
+    log: str. if given, append JSON progress records to this file (see _reporter)
     Output:
     dict. total:[(expr1,score),(expr2,score)] --> list of ways to get each combination
     '''
-    if verbose:
-        sys.stdout.write(f'Solving {w_dice}... '+' '*(9+n_unary))
     sols = {}
+    stats = stats if stats is not None else Counter()
+    report,n,expr = _reporter(w_dice,n_unary,stats,verbose,log),0,''
+    tick = (lambda e: report(e,n,len(sols))) if verbose or log else None
+    for res,expr,sc in stream_solutions(w_dice,b_dice,n_unary,stats,canonical,exact,tick):
+        if res in sols:
+            sols[res].append((expr,sc))
+        else:
+            sols[res] = [(expr,sc)]
+        n += 1
+    report(expr,n,len(sols),final=True)
+    prof.tally(stats,n)
+    if verbose:
+        print(_fmt_stats(stats))
+    return sols
+
+def stream_solutions(w_dice,b_dice=None,n_unary=0,stats=None,canonical=False,exact=False,\
+        tick=None):
+    '''
+    Generate and score valid math dice solutions one at a time, as they are found
+    Input: see gen_valid_solutions, tick see gen_valid_values
+    Output:
+    generator of (int,str,int). (total, postfix solution, score)
+    '''
     ans = b_dice if b_dice else valid_ans
-    for expr in gen_valid_exprs(w_dice,n_unary):
+    stats = stats if stats is not None else Counter()
+    for expr,value in gen_valid_values(w_dice,n_unary,set(ans),stats,canonical,exact,tick):
+        if (res := _int_result(value)) in ans:
+            yield res,expr,mp.score(expr)
+
+def _fmt_stats(stats):
+    '''
+    One-line summary of search counts
+    Input:
+    stats: Counter. from gen_valid_values
+    Output:
+    str. e.g. "nodes: 1500, evaluated: 120 | pruned: zero division 30, off target 900"
+    '''
+    main = ['nodes','evaluated']
+    pruned = ', '.join([f'{k} {v}' for k,v in sorted(stats.items()) if k not in main])
+    return ', '.join([f'{k}: {stats[k]}' for k in main])+f' | pruned: {pruned or "none"}'
+
+#########################################################################################
+# Progress
+# Reporting is rate-limited so it costs next to nothing: the clock is only read every
+# progress_check search nodes (so searches finding few or no solutions still report), and
+# a line printed or logged at most every progress_interval seconds (plus once when the
+# combo is done)
+progress_check = 1024
+progress_interval = 1.0
+
+def _reporter(w_dice,n_unary,stats,verbose=False,log=None):
+    '''
+    Progress reporter for solving one combo
+    Input:
+    w_dice: 5-tuple of int. white dice combination
+    n_unary: int. number of unary operators (!,?) allowable
+    stats: Counter. search counts, filled in as the search goes (see gen_valid_values)
+    verbose: bool. if true, redraw one progress line on stdout
+    log: str. if given, append each update to this file as a JSON record (one per line)
+    Output:
+    function. report(expr,n_sols,n_totals,final=False): expr is the latest (partial)
+        expression searched.
+        Returns the progress record (see _progress) if it reported, else None
+    '''
+    start = last = time.perf_counter()
+    def report(expr,n_sols,n_totals,final=False):
+        nonlocal last
+        now = time.perf_counter()
+        if not final and now-last < progress_interval:
+            return None
+        last = now
+        p = _progress(w_dice,n_unary,stats,n_sols,n_totals,now-start,\
+                1. if final else _fraction(w_dice,n_unary,expr))
         if verbose:
-            sys.stdout.write('\b'*(9+n_unary)+expr)
-        if type(res := mp.evaluate(expr,mode='postfix')) == int and res in ans:
-            if res in sols:
-                sols[res].append((expr,mp.score(expr)))
-            else:
-                sols[res] = [(expr,mp.score(expr))]
-    if verbose:
-        sys.stdout.write('\b'*(9+n_unary)+'Done'+' '*(n_unary+5)+'\n')
+            sys.stdout.write('\r'+_fmt_progress(p)+('\n' if final else ''))
+            sys.stdout.flush()
+        if log:
+            with open(log,'a') as f:
+                f.write(json.dumps(p)+'\n')
+        return p
+    return report
+
+def _progress(w_dice,n_unary,stats,n_sols,n_totals,elapsed,done):
+    '''
+    Progress record of a combo being solved
+    Input:
+    w_dice: 5-tuple of int. white dice combination
+    n_unary: int. number of unary operators (!,?) allowable
+    stats: Counter. search counts (see gen_valid_values)
+    n_sols: int. solutions found so far
+    n_totals: int. distinct totals solved so far
+    elapsed: float. seconds since solving started
+    done: float. estimated fraction of the search done (see _fraction)
+    Output:
+    dict. combo, n_unary, sols, totals, nodes, evaluated, pruned, elapsed, rate (nodes/s),
+        done, eta (seconds)
+    '''
+    pruned = sum([v for k,v in stats.items() if k not in ['nodes','evaluated']])
+    return {'combo':_w_str(w_dice),'n_unary':n_unary,'sols':n_sols,'totals':n_totals,\
+            'nodes':stats['nodes'],'evaluated':stats['evaluated'],'pruned':pruned,\
+            'elapsed':round(elapsed,3),'rate':round(stats['nodes']/max(elapsed,1e-9)),\
+            'done':round(done,4),'eta':round(elapsed*(1-done)/done,1) if done else None}
+
+def _fmt_progress(p):
+    '''
+    One-line summary of a progress record
+    Input:
+    p: dict. from _progress
+    Output:
+    str. e.g. "12346 u1  40% eta 3.0s | 1200 sols, 3 totals | 150000 nodes in 2.0s
+        (75000/s), 120 evaluated, 90000 pruned"
+    '''
+    eta = f'{p["eta"]:.1f}s' if p['eta'] is not None else '?'
+    return f'{p["combo"]} u{p["n_unary"]} {100*p["done"]:3.0f}% eta {eta} | '\
+            f'{p["sols"]} sols, {p["totals"]} totals | {p["nodes"]} nodes in '\
+            f'{p["elapsed"]:.1f}s ({p["rate"]}/s), {p["evaluated"]} evaluated, '\
+            f'{p["pruned"]} pruned'
+
+def _fraction(w_dice,n_unary,expr):
+    '''
+    Estimate how much of a combo's search is done from the latest expression searched
+    Replays the search's choices of next token (see _next_valid) along the expression:
+    each choice gets an equal share of its parent's part of the search tree,
+    so the estimate only grows as the search goes
+    Input:
+    w_dice: 5-tuple of int. white dice combination
+    n_unary: int. number of unary operators (!,?) allowable
+    expr: str. postfix expression, possibly partial
+    Output:
+    float. between 0 and 1
+    '''
+    dice,size,done,share = list(w_dice),0,0,1
+    for t in [int(t) if t.isdigit() else t for t in expr]:
+        choices = _next_valid(dice,size,n_unary)
+        share /= len(choices)
+        done += choices.index(t)*share
+        dice,size,n_unary = _rm_die(dice,t),size+op_change[t],n_unary-(t in unary_ops)
+    return done
+
+#########################################################################################
+# Value-Set Dynamic Programming
+# Values are exact (see md_parser.exact_func), so equal values always share a table entry
+# Value tables kept in memory, least recently used dropped: one combo has at most 31
+# sub-multisets of dice times 7 unary levels (up to live_max_unary), so a whole combo fits
+values_cache = 256
+
+def dp_solutions(w_dice,b_dice,n_unary=0):
+    '''
+    All solutions to a configuration using exactly n_unary unaries,
+    rebuilt from the value tables instead of a full expression search
+    Same solutions as gen_valid_solutions(w_dice,[b_dice],n_unary,exact=True)[b_dice],
+    in any order
+    Input:
+    w_dice: 5-tuple of int. white dice combination
+    b_dice: int. black dice total
+    n_unary: int. number of unary operators (!,?) allowable
+    Output:
+    list. [(solution,score),(solution,score)]
+    '''
+    return [(e,mp.score(e)) for v,p in _combine(tuple(sorted(w_dice)),n_unary)\
+            if v == b_dice for e in _expand(p)]
+
+def dp_solution(w_dice,b_dice,n_unary=0):
+    '''
+    One solution to a configuration using exactly n_unary unaries
+    Input:
+    w_dice: 5-tuple of int. white dice combination
+    b_dice: int. black dice total
+    n_unary: int. number of unary operators (!,?) allowable
+    Output:
+    str or None. postfix solution, None if there is none
+    '''
+    return next((_expand_one(p) for v,p in _combine(tuple(sorted(w_dice)),n_unary)\
+            if v == b_dice),None)
+
+def dp_totals(w_dice,n_unary=0,targets=None):
+    '''
+    Black dice totals reachable using exactly n_unary unaries
+    Stops as soon as every target has been reached
+    Input:
+    w_dice: 5-tuple of int. white dice combination
+    n_unary: int. number of unary operators (!,?) allowable
+    targets: set of int. totals to look for. If none, defaults to all
+    Output:
+    set of int. reachable totals among targets
+    '''
+    targets = set(targets if targets is not None else valid_ans)
+    found = set()
+    for v,p in _combine(tuple(sorted(w_dice)),n_unary):
+        if v in targets and v not in found:
+            found.add(int(v))
+            if len(found) == len(targets):
+                break
+    return found
+
+def dp_levels(w_dice,levels,b_dice=None,unsolved=False):
+    '''
+    Solutions for several unary levels, built in increasing order so each level is made
+    from the value tables of the levels below (see _combine): building levels 0..k
+    costs little more than level k alone
+    Same solutions as gen_valid_solutions(w_dice,b_dice,n_unary,exact=True) per level
+    Input:
+    w_dice: tuple of int. white dice combination
+    levels: iterable of int. unary levels (numbers of !,? used) to solve
+    b_dice: list of int. black dice totals to solve for. If none, defaults to all
+    unsolved: bool. if true, each level only solves totals no lower level has solved
+        (lower levels are checked even if not in levels)
+    Output:
+    generator of (int,dict). (n_unary, total:[(expr1,score),(expr2,score)]),
+        in increasing order of n_unary
+    '''
+    dice,levels = tuple(sorted(w_dice)),set(levels)
+    left = set(b_dice if b_dice else valid_ans)
+    for n in range(max(levels,default=-1)+1):
+        if n in levels:
+            vs = _dp_level(dice,n,left)
+            yield n,vs
+            found = set(vs)
+        else:
+            found = dp_totals(dice,n,left) if unsolved else set()
+        if unsolved and not (left := left-found):
+            break
+
+def _dp_level(dice,n_unary,targets):
+    '''
+    All solutions using exactly n_unary unaries, for every target, in one pass over
+    the value tables
+    Input:
+    dice: sorted tuple of int. white dice combination
+    n_unary: int. number of unary operators (!,?) to use
+    targets: set of int. black dice totals to solve for
+    Output:
+    dict. total:[(expr1,score),(expr2,score)] --> as from gen_valid_solutions
+    '''
+    prods = {}
+    for v,p in _combine(dice,n_unary):
+        if v in targets:
+            prods.setdefault(int(v),[]).append(p)
+    return {v:[(e,mp.score(e)) for p in ps for e in _expand(p)] for v,ps in prods.items()}
+
+def _splits(dice):
+    '''
+    Ordered splits of a multiset of dice into two non-empty sub-multisets
+    Input:
+    dice: sorted tuple of int
+    Output:
+    generator of (tuple,tuple). (left operand dice, right operand dice), each sorted
+    '''
+    ds = sorted(set(dice))
+    for counts in it.product(*[range(dice.count(d)+1) for d in ds]):
+        left = sum([(d,)*c for d,c in zip(ds,counts)],())
+        if 0 < len(left) < len(dice):
+            right = sum([(d,)*(dice.count(d)-c) for d,c in zip(ds,counts)],())
+            yield left,right
+
+def _combine(dice,n_unary):
+    '''
+    Every way to make a value from exactly these dice and n_unary unaries,
+    one level up from the value tables of smaller problems
+    Producers are back-pointers:
+    (digit,) --> single die
+    (op,dice,n_unary,value) --> unary op applied to value from (dice,n_unary)
+    (op,l_dice,l_unary,l_value,r_dice,r_unary,r_value) --> binary op on two values
+    Input:
+    dice: sorted tuple of int. dice to use
+    n_unary: int. number of unary operators (!,?) to use
+    Output:
+    generator of (number,tuple). (value, producer)
+    '''
+    # Base Case: single die
+    if len(dice) == 1 and not n_unary:
+        yield dice[0],(str(dice[0]),)
+    # Unary op on top of everything else
+    if n_unary:
+        for x in _values(dice,n_unary-1):
+            for t in unary_ops:
+                try:
+                    yield mp.exact_func[t](x),(t,dice,n_unary-1,x)
+                except mp.calc_errors:
+                    pass
+    # Binary op on values from disjoint dice, unaries shared out between them
+    for l_dice,r_dice in _splits(dice):
+        for l_unary in range(n_unary+1):
+            r_vals = _values(r_dice,n_unary-l_unary)
+            for a in _values(l_dice,l_unary):
+                for b in r_vals:
+                    for t in pemdas_ops:
+                        try:
+                            yield mp.exact_func[t](a,b),(t,l_dice,l_unary,a,r_dice,n_unary-l_unary,b)
+                        except mp.calc_errors:
+                            pass
+
+@lru_cache(maxsize=values_cache)
+def _values(dice,n_unary):
+    '''
+    Value table: every value reachable with exactly these dice and n_unary unaries
+    Memoized on (sorted sub-multiset, unary budget), the values_cache most recent kept
+    Input:
+    dice: sorted tuple of int. dice to use
+    n_unary: int. number of unary operators (!,?) to use
+    Output:
+    dict. value:producer --> first way found to make each value (see _combine)
+    '''
+    vals = {}
+    for v,p in _combine(dice,n_unary):
+        vals.setdefault(v,p)
+    return vals
+
+@lru_cache(maxsize=64)
+def _producers(dice,n_unary):
+    '''
+    Full back-pointer table: every way to make every value, for rebuilding all solutions
+    Input:
+    dice: sorted tuple of int. dice to use
+    n_unary: int. number of unary operators (!,?) to use
+    Output:
+    dict. value:[producer,producer] (see _combine)
+    '''
+    prods = {}
+    for v,p in _combine(dice,n_unary):
+        prods.setdefault(v,[]).append(p)
+    return prods
+
+def _expand(p):
+    '''
+    Rebuild all postfix expressions behind a producer
+    Input:
+    p: tuple. producer (see _combine)
+    Output:
+    generator of str. postfix expressions
+    '''
+    # Single die
+    if len(p) == 1:
+        yield p[0]
+    # Unary op
+    elif len(p) == 4:
+        t,dice,n_unary,x = p
+        for q in _producers(dice,n_unary)[x]:
+            yield from (e+t for e in _expand(q))
+    # Binary op
+    else:
+        t,l_dice,l_unary,a,r_dice,r_unary,b = p
+        rs = [e for q in _producers(r_dice,r_unary)[b] for e in _expand(q)]
+        for q in _producers(l_dice,l_unary)[a]:
+            yield from (l+r+t for l in _expand(q) for r in rs)
+
+def _expand_one(p):
+    '''
+    Rebuild one postfix expression behind a producer, following first back-pointers
+    Input:
+    p: tuple. producer (see _combine)
+    Output:
+    str. postfix expression
+    '''
+    if len(p) == 1:
+        return p[0]
+    if len(p) == 4:
+        t,dice,n_unary,x = p
+        return _expand_one(_values(dice,n_unary)[x])+t
+    t,l_dice,l_unary,a,r_dice,r_unary,b = p
+    return _expand_one(_values(l_dice,l_unary)[a])+_expand_one(_values(r_dice,r_unary)[b])+t
+
+#########################################################################################
+# Best Solutions
+# Scores only add up along an expression (see md_parser.score), so the least score behind
+# every value of the back-pointer tables is one pass over them, and rebuilding only the
+# producers that stay within a score bound gives the best solutions without the others
+# Cheapest unary op, for score bounds
+unary_floor = min([mp.penalties[t] for t in unary_ops])
+# Most costly binary and unary ops, for the highest score a level can reach
+binary_ceil = max([mp.penalties.get(t,0) for t in pemdas_ops])
+unary_ceil = max([mp.penalties[t] for t in unary_ops])
+
+def best_solutions(w_dice,b_dice,max_unary=6,k=None,fewest=False):
+    '''
+    Best-scoring solutions to a configuration, from the value tables (see _least)
+    Only the producers that can stay within the best score are rebuilt, and unary counts
+    above the fewest that solve it only once the score can pay for their unaries
+    Input:
+    w_dice: 5-tuple of int. white dice combination
+    b_dice: int. black dice total
+    max_unary: int. max allowed number of unary ops (! or ?)
+    k: int. if given, the k best solutions over all unary counts (the score bound is
+        raised until there are k), else all solutions with the best score
+    fewest: bool. if true, only solutions with the fewest unaries that solve it
+        (as in a db generated in unsolved mode)
+    Output:
+    list. [(solution,score),(solution,score)] in order of score. Empty if unsolvable
+    '''
+    dice = tuple(sorted(w_dice))
+    n = min_unary(dice,b_dice,max_unary)
+    if n is None:
+        return []
+    roots = {n:[p for v,p in _combine(dice,n) if v == b_dice]}
+    bound = min([_least_of(p) for p in roots[n]])
+    top = n if fewest else max_unary
+    # Highest score any solution can have
+    ceil = binary_ceil*(len(dice)-1)+unary_ceil*top
+    while True:
+        # Unary counts the bound can pay for
+        for m in range(n+1,top+1):
+            if m not in roots and unary_floor*m <= bound:
+                roots[m] = [p for v,p in _combine(dice,m) if v == b_dice]
+                bound = min([bound]+[_least_of(p) for p in roots[m]])
+        sols = sorted([x for ps in roots.values() for p in ps\
+                if _least_of(p) <= bound for x in _expand_within(p,bound)],key=lambda x: x[1])
+        if not k or len(sols) >= k or bound >= ceil:
+            break
+        bound += 1
+    return sols[:k] if k else sols
+
+@lru_cache(maxsize=64)
+def _least(dice,n_unary):
+    '''
+    Least score table: the lowest score of any expression making each value with exactly
+    these dice and n_unary unaries
+    Input:
+    dice: sorted tuple of int. dice to use
+    n_unary: int. number of unary operators (!,?) to use
+    Output:
+    dict. value:least score
+    '''
+    return {v:min([_least_of(p) for p in ps]) for v,ps in _producers(dice,n_unary).items()}
+
+def _least_of(p):
+    '''
+    Lowest score of any expression behind a producer (see _combine)
+    '''
+    if len(p) == 1:
+        return 0
+    if len(p) == 4:
+        t,dice,n_unary,x = p
+        return mp.penalties[t]+_least(dice,n_unary)[x]
+    t,l_dice,l_unary,a,r_dice,r_unary,b = p
+    return mp.penalties.get(t,0)+_least(l_dice,l_unary)[a]+_least(r_dice,r_unary)[b]
+
+def _expand_within(p,bound):
+    '''
+    Rebuild the postfix expressions behind a producer scoring at most bound, like _expand
+    Branches whose least score (see _least) is over what is left of the bound are skipped
+    Input:
+    p: tuple. producer (see _combine)
+    bound: int. highest score to rebuild
+    Output:
+    generator of (str,int). (postfix expression, score)
+    '''
+    if len(p) == 1:
+        yield p[0],0
+    elif len(p) == 4:
+        t,dice,n_unary,x = p
+        c = mp.penalties[t]
+        for q in _producers(dice,n_unary)[x]:
+            if _least_of(q) <= bound-c:
+                yield from ((e+t,sc+c) for e,sc in _expand_within(q,bound-c))
+    else:
+        t,l_dice,l_unary,a,r_dice,r_unary,b = p
+        c,r_least = mp.penalties.get(t,0),_least(r_dice,r_unary)[b]
+        for q in _producers(l_dice,l_unary)[a]:
+            if _least_of(q) > bound-c-r_least:
+                continue
+            for l,l_sc in _expand_within(q,bound-c-r_least):
+                left = bound-c-l_sc
+                for r_q in _producers(r_dice,r_unary)[b]:
+                    if _least_of(r_q) <= left:
+                        yield from ((l+r+t,l_sc+r_sc+c) for r,r_sc in _expand_within(r_q,left))
+
+#########################################################################################
+# Vectorized Templates
+# A template is a postfix expression with its digits left as slots: 'dd+d*'
+# Each template is evaluated for every ordering of every white dice combo at once,
+# as numpy arrays with one row per ordering
+# numpy rounds + - * / and termials exactly as Python floats do, as long as values stay
+# under 2^53 (Python ints are exact past that). Powers only match when they are whole
+# numbers (np.power vs math.pow). Other rows are "loose": whole numbers are matched
+# within vector_tol, and confirmed with md_parser.evaluate_many
+# Relative tolerance for whole-number checks on loose rows
+vector_tol = 1e-9
+# White dice combos per vector_solutions call in make_sols_db
+vector_chunk = 21
+
+def vector_solutions(ws,n_unary=0,b_dice=None):
+    '''
+    Generate and score valid solutions for many white dice combos at once
+    Same solutions as gen_valid_solutions for each combo. Requires numpy
+    Input:
+    ws: list of tuples. white dice combinations, all the same size
+    n_unary: int. number of unary operators (!,?) allowable
+    b_dice: list of int. black dice totals to solve for. If none, defaults to all
+    Output:
+    dict. w_dice:{total:[(expr1,score),(expr2,score)]} --> as from gen_valid_solutions
+    '''
+    assert np is not None, 'vector_solutions requires numpy'
+    ws = {tuple(sorted(w)) for w in ws}
+    # One row per ordering of each combo's dice
+    rows = [r for r in it.product(range(1,7),repeat=len(next(iter(ws)))) if tuple(sorted(r)) in ws]
+    combos = [tuple(sorted(r)) for r in rows]
+    digits = [''.join(map(str,r)) for r in rows]
+    cols = np.array(rows,dtype=float).T
+    targets = np.array(sorted(b_dice if b_dice else valid_ans),dtype=float)
+    sols = {w:{} for w in ws}
+    none = np.zeros(len(rows),dtype=bool)
+    with np.errstate(all='ignore'):
+        for tmpl,value,ok,loose in _vec_eval('',cols,n_unary,(),~none,none):
+            idx = np.flatnonzero(ok & np.isin(np.round(value),targets))
+            if not len(idx):
+                continue
+            pieces,sc = tmpl.split('d'),mp.score(tmpl)
+            exprs = [''.join([p+d for p,d in zip(pieces,digits[i])])+pieces[-1] for i in idx]
+            res = [int(v) for v in np.round(value[idx])]
+            # Confirm loose rows with the same float arithmetic as gen_valid_values
+            if (check := [j for j,i in enumerate(idx) if loose[i]]):
+                vals,errs = mp.evaluate_many([mp.to_codes(exprs[j]) for j in check])
+                for j,v,err in zip(check,vals,errs):
+                    res[j] = res[j] if not err and v == res[j] else None
+            for i,expr,r in zip(idx,exprs,res):
+                if r is not None:
+                    sols[combos[i]].setdefault(r,[]).append((expr,sc))
     return sols
 
+def _vec_eval(tmpl,cols,n_unary,stack,ok,loose):
+    '''
+    Recursively generate templates and evaluate them for all rows
+    Like _gen_eval, each token is applied once per node of the template tree
+    Input:
+    tmpl: str. partially generated template
+    cols: 2d array. dice, one column per row, one row per slot
+    n_unary: int. number of unary operators (!,?) allowable
+    stack: tuple of arrays. calc stack of tmpl, evaluated so far
+    ok: bool array. rows whose calculation hasn't failed
+    loose: bool array. rows numpy may not have calculated exactly as Python would
+    Output:
+    generator of (str,array,array,array). (template, values, rows that may be whole
+        numbers, loose rows)
+    '''
+    slot = len(tmpl)-sum([t in mp.operators for t in tmpl])
+    # Base Case: All slots and unaries used and stack size 1, i.e. result calculated
+    if slot == len(cols) and not n_unary and len(stack) == 1:
+        yield tmpl,stack[0],ok & _vec_whole(stack[0],loose),loose
+    # Next slot
+    if slot < len(cols):
+        yield from _vec_eval(tmpl+'d',cols,n_unary,stack+(cols[slot],),ok,loose)
+    # Operators
+    for t in pemdas_ops*(len(stack) > 1)+unary_ops*(len(stack)*n_unary > 0):
+        k = mp.n_operands[t]
+        value,good,exact = _vec_op(t,loose,*stack[-k:])
+        # Drop the whole branch once every row has failed
+        if (o := ok & good).any():
+            yield from _vec_eval(tmpl+t,cols,n_unary-(k == 1),stack[:-k]+(value,),o,\
+                    loose | ~exact)
+
+def _vec_op(t,loose,*xs):
+    '''
+    Apply an operator to arrays of operands
+    Rows fail where the operation would raise in md_parser.op_func
+    (loose rows: up to vector_tol for whole-number checks)
+    Input:
+    t: str. operator
+    loose: bool array. loose rows (see vector_solutions)
+    xs: arrays. operands
+    Output:
+    (array,array,array). (values, rows that didn't fail, rows calculated exactly)
+    '''
+    if t == '!':
+        x = np.round(xs[0])
+        good = (x >= 0) & (x < len(mp.fact)) & _vec_whole(xs[0],loose)
+        v = np.array([mp.fact[n] for n in range(len(mp.fact))],dtype=float)\
+                [np.where(good,x,0).astype(int)]
+    elif t == '?':
+        x = xs[0]
+        v,good = (x+1)*(x/2),(np.round(x) >= 0) & _vec_whole(x,loose)
+    elif t == '/':
+        v,good = xs[0]/xs[1],xs[1] != 0
+    elif t == '^':
+        a,b = xs
+        v = np.power(a,b)
+        # math.pow raises when finite operands give inf (overflow) or nan (domain)
+        good = np.isfinite(v) | ~(np.isfinite(a) & np.isfinite(b))
+        # Only whole powers of whole numbers are sure to match math.pow
+        return v,good,_vec_whole(a,False) & _vec_whole(b,False) & (b >= 0) &\
+                _vec_whole(v,False) & (np.abs(v) < 2**53)
+    else:
+        v,good = {'+':np.add,'-':np.subtract,'*':np.multiply}[t](*xs),True
+    return v,good,np.abs(v) < 2**53
+
+def _vec_whole(x,loose):
+    '''
+    Rows of x that are whole numbers, up to vector_tol on loose rows
+    '''
+    return np.isfinite(x) &\
+            (np.abs(x-np.round(x)) <= np.where(loose,vector_tol*np.maximum(1,np.abs(x)),0))
+
 #########################################################################################
 # Store Results
 
-def make_sols_db(db_name,ws=None,n_unary=0,verbose=False):
+def make_sols_db(db_name,ws=None,n_unary=0,verbose=False,canonical=False,jobs=1,\
+        exact=False,vector=False,buffer=None,log=None):
     '''
     Store scored solutions for all math dice configurations
     Directory Structure:
     data/
         11111/
+            .u0.done
+            ... [one per finished n_unary]
             11/
                 u0.p
                 u1.p
@@ -130,99 +897,408 @@ def make_sols_db(db_name,ws=None,n_unary=0,verbose=False):
             ... [results in valid_ans]
         11112/
         ... [w_dice]
+    Each combo's files are written atomically and then marked done.
+    Combos already marked done are skipped, so an interrupted run can just be restarted
     Input:
     db_name: str. name of data parent directory
     ws. list of tuples. white dice combinations to try. If none, defaults to all
     n_unary: int. number of unary operators (!,?) allowable
+    canonical: bool. if true, store one spelling per reordering of + and * chains
+        (calculated exactly, see gen_valid_values)
+    jobs: int. number of worker processes. Combos are handed out one at a time,
+        most expensive first, so workers stay busy until the end
+    exact: bool. if true, exact arithmetic (see gen_valid_values), else floats
+    vector: bool. if true, solve vector_chunk combos at a time with vector_solutions
+        (needs numpy; not with canonical or exact)
+    buffer: int. if given, stream each combo's solutions to disk as they are found,
+        holding at most this many in memory (see _stream_combo)
+    log: str. if given, append JSON progress records of every combo to this file
+        (see _reporter). Progress lines are printed only in verbose mode with one job
     '''
-    # For every possible white dice combo
-    for w_dice in it.combinations_with_replacement(range(1,7),5):
-        # Make output dir
-        dir_name = f'{db_name}/{"".join([str(w) for w in w_dice])}'
-        subprocess.run(['mkdir','-p',dir_name])
-        # If white dice specified in ws or ws not specified (i.e. run all)
-        if not ws or w_dice in ws:
-            b_dice = ws[w_dice] if type(ws) is dict else None
-            vs = gen_valid_solutions(w_dice,b_dice,n_unary,verbose)
-            if verbose:
-                sys.stdout.write(f'u{n_unary} sols: ')
-            # For all results reachable with given n_unary
-            for res in vs:
-                # Make parent directories if needed
-                subprocess.run(['mkdir','-p',f'{dir_name}/{res}'])
-                # Save data/w_dice/b_dice/uX.p file
-                with open(f'{dir_name}/{res}/u{n_unary}.p','wb') as out:
+    # White dice specified in ws or ws not specified (i.e. run all), and not done yet
+    todo = [(w_dice,ws[w_dice] if type(ws) is dict else None,n_unary,canonical,exact,log)\
+            for w_dice in it.combinations_with_replacement(range(1,7),5)\
+            if (not ws or w_dice in ws) and not _combo_done(db_name,w_dice,n_unary)]
+    if buffer:
+        tasks = [(db_name,)+t+(buffer,verbose and jobs == 1) for t in todo]
+        if jobs > 1:
+            tasks.sort(key=lambda t: -len(set(it.permutations(t[1]))))
+            with Pool(jobs) as pool:
+                for line in pool.imap_unordered(_stream_task,tasks):
                     if verbose:
-                        sys.stdout.write(f'{res} ')
-                    pkl.dump(vs[res],out)
+                        print(line)
+        else:
+            for task in tasks:
+                _stream_task(task)
+    elif vector:
+        assert not (canonical or exact), 'vector solving is float and non-canonical only'
+        for i in range(0,len(todo),vector_chunk):
+            chunk = todo[i:i+vector_chunk]
+            sols = vector_solutions([t[0] for t in chunk],n_unary)
+            for w_dice,b_dice,*_ in chunk:
+                vs = {k:v for k,v in sols[w_dice].items() if not b_dice or k in b_dice}
+                if verbose:
+                    print(f'{_w_str(w_dice)} u{n_unary} sols: {" ".join(map(str,vs))}')
+                _write_combo(db_name,w_dice,n_unary,vs)
+    elif jobs > 1:
+        # Longest first: more distinct orderings of the dice, more expressions to search
+        todo.sort(key=lambda t: -len(set(it.permutations(t[0]))))
+        with Pool(jobs) as pool:
+            for w_dice,vs in pool.imap_unordered(_solve_combo,todo):
+                if verbose:
+                    print(f'{_w_str(w_dice)} u{n_unary} sols: {" ".join(map(str,vs))}')
+                _write_combo(db_name,w_dice,n_unary,vs)
+    else:
+        for w_dice,b_dice,n_unary,canonical,exact,log in todo:
+            vs = gen_valid_solutions(w_dice,b_dice,n_unary,verbose,canonical=canonical,\
+                    exact=exact,log=log)
             if verbose:
-                print('')
+                print(f'u{n_unary} sols: {" ".join(map(str,vs))}')
+            _write_combo(db_name,w_dice,n_unary,vs)
+
+def _solve_combo(task):
+    '''
+    Worker for make_sols_db: solve one white dice combo quietly
+    Input:
+    task: tuple. (w_dice,b_dice,n_unary,canonical,exact,log)
+    Output:
+    (tuple,dict). (w_dice, results of gen_valid_solutions)
+    '''
+    w_dice,b_dice,n_unary,canonical,exact,log = task
+    return w_dice,gen_valid_solutions(w_dice,b_dice,n_unary,canonical=canonical,exact=exact,\
+            log=log)
+
+def make_sols_levels(db_name,levels,ws=None,verbose=False,unsolved=True,jobs=1):
+    '''
+    Store scored solutions for several unary levels at once, like make_sols_db per level
+    Each combo's levels are built in order from the same value tables (see dp_levels),
+    instead of searching every level from scratch. Solutions are exact (as make_sols_db
+    with exact=True) and in every spelling
+    Levels already marked done are not written again, so an interrupted run can just be
+    restarted
+    Input:
+    db_name: str. name of data parent directory
+    levels: iterable of int. unary levels to store (e.g. range(7))
+    ws. list of tuples or dict. white dice combinations to try, or
+        white dice:[black dice totals]. If none, defaults to all
+    verbose: bool. print one line per combo and level
+    unsolved: bool. if true, each level only stores totals no lower level solved
+        (like generate in unsolved mode)
+    jobs: int. number of worker processes, one combo at a time
+    '''
+    levels = sorted(levels)
+    todo = [(db_name,w_dice,ws[w_dice] if type(ws) is dict else None,levels,unsolved)\
+            for w_dice in it.combinations_with_replacement(range(1,7),5)\
+            if (not ws or w_dice in ws) and\
+            not all([_combo_done(db_name,w_dice,n) for n in levels])]
+    if jobs > 1:
+        todo.sort(key=lambda t: -len(set(it.permutations(t[1]))))
+        with Pool(jobs) as pool:
+            for lines in pool.imap_unordered(_levels_task,todo):
+                if verbose:
+                    print('\n'.join(lines))
+    else:
+        for task in todo:
+            _levels_task(task,verbose)
+
+def _levels_task(task,verbose=False):
+    '''
+    Worker for make_sols_levels: build and write one combo's levels
+    The value tables are dropped afterwards, so memory is bounded by one combo
+    Input:
+    task: tuple. (db_name,w_dice,b_dice,levels,unsolved)
+    verbose: bool. if true, print each line as its level is written
+    Output:
+    list of str. one summary line per level written
+    '''
+    db_name,w_dice,b_dice,levels,unsolved = task
+    lines,start = [],time.perf_counter()
+    todo = [n for n in levels if not _combo_done(db_name,w_dice,n)]
+    for n,vs in dp_levels(w_dice,todo,b_dice,unsolved):
+        _write_combo(db_name,w_dice,n,vs)
+        lines.append(f'{_w_str(w_dice)} u{n}: {sum(map(len,vs.values()))} sols, '\
+                f'{len(vs)} totals in {time.perf_counter()-start:.1f}s')
+        if verbose:
+            print(lines[-1])
+    # Levels never reached (all totals solved below) are done too
+    for n in todo:
+        if not _combo_done(db_name,w_dice,n):
+            _write_combo(db_name,w_dice,n,{})
+    _values.cache_clear()
+    _producers.cache_clear()
+    _least.cache_clear()
+    return lines
+
+def _stream_task(task):
+    '''
+    Worker for make_sols_db: stream one white dice combo's solutions to disk
+    Input:
+    task: tuple. (db_name,w_dice,b_dice,n_unary,canonical,exact,log,buffer,verbose)
+    Output:
+    str. summary line (see _fmt_progress)
+    '''
+    return _stream_combo(*task)
+
+def _stream_combo(db_name,w_dice,b_dice,n_unary,canonical,exact,log,buffer,verbose=False):
+    '''
+    Solve one combo and write it like _write_combo, without holding all its solutions
+    Solutions are buffered, and every buffer solutions appended to the combo's temporary
+    files as one more pickled chunk (read back with md_db.load_sols)
+    Input:
+    db_name: str. name of data parent directory
+    w_dice: 5-tuple of int. white dice combination
+    b_dice: list of int. black dice totals to solve for. If none, defaults to all
+    n_unary: int. number of unary operators (!,?) allowable
+    canonical, exact: bool. see gen_valid_solutions
+    log: str. if given, append JSON progress records to this file (see _reporter)
+    buffer: int. most solutions held in memory at once
+    verbose: bool. if true, redraw a progress line (see _reporter)
+    Output:
+    str. summary line (see _fmt_progress)
+    '''
+    dir_name = os.path.join(db_name,_w_str(w_dice))
+    tmp = lambda res: os.path.join(dir_name,f'.u{n_unary}.{res}.tmp')
+    os.makedirs(dir_name,exist_ok=True)
+    stats,found,pending,n,expr = Counter(),Counter(),{},0,''
+    report = _reporter(w_dice,n_unary,stats,verbose,log)
+    tick = (lambda e: report(e,n,len(found))) if verbose or log else None
+    def flush():
+        with prof.stage('write'):
+            for res,chunk in pending.items():
+                # First chunk truncates anything left by an interrupted run
+                with open(tmp(res),'ab' if found[res] > len(chunk) else 'wb') as out:
+                    pkl.dump(chunk,out)
+        pending.clear()
+    for res,expr,sc in stream_solutions(w_dice,b_dice,n_unary,stats,canonical,exact,tick):
+        pending.setdefault(res,[]).append((expr,sc))
+        found[res] += 1
+        n += 1
+        if not n % buffer:
+            flush()
+    flush()
+    with prof.stage('write'):
+        for res in found:
+            os.makedirs(os.path.join(dir_name,str(res)),exist_ok=True)
+            os.replace(tmp(res),os.path.join(dir_name,str(res),f'u{n_unary}.p'))
+        open(os.path.join(dir_name,f'.u{n_unary}.done'),'w').close()
+        db.touch(db_name)
+    prof.tally(stats,n)
+    return _fmt_progress(report(expr,n,len(found),final=True))
+
+def _w_str(w_dice):
+    '''
+    White dice as a db directory name: (1,1,2,3,6) --> '11236'
+    '''
+    return ''.join([str(w) for w in w_dice])
+
+def _combo_done(db_name,w_dice,n_unary):
+    '''
+    Check whether make_sols_db already finished a combo at this unary level
+    '''
+    return os.path.isfile(os.path.join(db_name,_w_str(w_dice),f'.u{n_unary}.done'))
+
+def _write_combo(db_name,w_dice,n_unary,vs):
+    '''
+    Save one combo's solutions as data/w_dice/b_dice/uX.p files, then mark it done
+    Each file is written under a temporary name and renamed into place
+    Input:
+    db_name: str. name of data parent directory
+    w_dice: 5-tuple of int. white dice combination
+    n_unary: int. number of unary operators (!,?) allowable
+    vs: dict. total:[(expr1,score),(expr2,score)] from gen_valid_solutions
+    '''
+    dir_name = os.path.join(db_name,_w_str(w_dice))
+    # For all results reachable with given n_unary
+    for res in vs:
+        os.makedirs(os.path.join(dir_name,str(res)),exist_ok=True)
+        tmp = os.path.join(dir_name,f'.u{n_unary}.{res}.tmp')
+        with open(tmp,'wb') as out:
+            pkl.dump(vs[res],out)
+        os.replace(tmp,os.path.join(dir_name,str(res),f'u{n_unary}.p'))
+    os.makedirs(dir_name,exist_ok=True)
+    open(os.path.join(dir_name,f'.u{n_unary}.done'),'w').close()
+    db.touch(db_name)
 
 #########################################################################################
 # Analyze
+# Live solving, when there is no db (see live_sols)
+# Configurations kept in memory
+live_cache = 256
+# Most unary ops searched
+live_max_unary = 6
+# If set, directory to save live results to, and read them from
+live_dir = None
 
-def get_sols(w_dice,b_dice,db_name):
+def get_sols(w_dice,b_dice,db_name,just_best=False):
     '''
     Find All Solutions to given configuration from dbs
     Input:
     w_dice: 5-tuple of int. white dice combination
     b_dice: int. black dice total
-    db_name: str. name of solution db directory
+    db_name: str. solutions store file (see md_db) or name of legacy solution db directory.
+        If there is none, solved on demand (see live_sols)
+    just_best: bool. If true, only solutions with the best score
     Output: list. [(solution,score),(solution,score)]
     '''
-    w = tuple(sorted(w_dice))
-    s_dir = os.path.join(db_name,''.join([str(w) for w in w_dice]),str(b_dice))
+    # Single-file store
+    if db.is_db(db_name):
+        return db.get_sols(w_dice,b_dice,db_name,just_best)
+    # No db at all: solve on demand
+    if not db_name or not os.path.isdir(db_name):
+        return live_sols(w_dice,b_dice,just_best)
+    # Legacy directory of pickles
+    s_dir = os.path.join(db_name,_w_str(sorted(w_dice)),str(b_dice))
     sols = []
     if os.path.isdir(s_dir):
         for f in os.listdir(s_dir):
             with open(os.path.join(s_dir,f),'rb') as u:
-                sols.extend(pkl.load(u))
+                sols.extend(db.load_sols(u))
+    if just_best and sols:
+        best = min([sc for e,sc in sols])
+        return [(e,sc) for e,sc in sols if sc == best]
     return sols
 
-def unsolvable(w_dice,db_name,max_unary=10):
+def get_humanized(w_dice,b_dice,db_name,just_best=False):
+    '''
+    Humanized solutions to given configuration (see md_humanizer.humanize)
+    Read precomputed from a solutions store when it has them, otherwise humanized live
+    Input:
+    w_dice: 5-tuple of int. white dice combination
+    b_dice: int. black dice total
+    db_name: str. solutions store file (see md_db) or name of legacy solution db directory
+    just_best: bool. If true, only groups with the best score
+    Output: list. ((normalized-infix,score),[equivalents]), sorted by score and lex
+    '''
+    if db.is_db(db_name) and (hs := db.get_humanized(w_dice,b_dice,db_name,just_best)) is not None:
+        return hs
+    return mh.humanize(get_sols(w_dice,b_dice,db_name,just_best))
+
+def live_sols(w_dice,b_dice,just_best=False,max_unary=None):
+    '''
+    Solutions to a configuration solved on demand, as a db generated in unsolved mode
+    has them: every solution with the fewest unaries that solve it (exact, see dp_levels)
+    All of them are built from the value tables, just the best with a min-score pass over
+    them (see best_solutions). The live_cache most recent results are kept in memory, and
+    if live_dir is set, full results are also saved there as a legacy db, filled lazily
+    Input:
+    w_dice: 5-tuple of int. white dice combination
+    b_dice: int. black dice total
+    just_best: bool. If true, only solutions with the best score
+    max_unary: int. max allowed number of unary ops (! or ?). If none, live_max_unary
+    Output: list. [(solution,score),(solution,score)]
+    '''
+    max_unary = live_max_unary if max_unary is None else max_unary
+    return list(_live(tuple(sorted(w_dice)),b_dice,just_best,max_unary,live_dir))
+
+@lru_cache(maxsize=live_cache)
+def _live(w_dice,b_dice,just_best,max_unary,cache_dir):
+    '''
+    Memoized live_sols, reading and filling the on-disk cache
+    Best-only results are read from it if saved, but not saved: it holds full results
+    Output: tuple. ((solution,score),(solution,score))
+    '''
+    s_dir = os.path.join(cache_dir,_w_str(w_dice),str(b_dice)) if cache_dir else None
+    if s_dir and os.path.isdir(s_dir):
+        return tuple(get_sols(w_dice,b_dice,cache_dir,just_best))
+    if just_best:
+        return tuple(best_solutions(w_dice,b_dice,max_unary,fewest=True))
+    n = min_unary(w_dice,b_dice,max_unary)
+    sols = _dp_level(w_dice,n,{b_dice}).get(b_dice,[]) if n is not None else []
+    if s_dir:
+        # An empty directory records that there are no solutions
+        os.makedirs(s_dir,exist_ok=True)
+        if sols:
+            # Renamed out of the combo directory, and the db touched, so its solvability
+            # index is refreshed (see md_db.solvability)
+            tmp = os.path.join(os.path.dirname(s_dir),f'.u{n}.{b_dice}.tmp')
+            with open(tmp,'wb') as out:
+                pkl.dump(sols,out)
+            os.replace(tmp,os.path.join(s_dir,f'u{n}.p'))
+            db.touch(cache_dir)
+    return tuple(sols)
+
+def unsolvable(w_dice,db_name=None,max_unary=6):
     '''
     List unsolvable black dice totals for each white die configuration
+    Answered from the value tables (see dp_totals), one unary level at a time,
+    or from a db's solvability index (see md_db.solvability)
+    Input:
+    w_dice: 5-tuple of int. white dice combination
+    db_name: str. if given, totals with no solutions in this db, up to max_unary
+    max_unary: int. max allowed number of unary ops (! or ?). Defaults to the depth of
+        the full db
+    Output: list of int. unsolvable black dice configs for given white dice config
+    '''
+    if db_name:
+        return _unsolved(db.solvability(db_name).get(_w_str(sorted(w_dice)),()),max_unary)
+    left = set(valid_ans)
+    for n in range(max_unary+1):
+        if not left:
+            break
+        left -= dp_totals(w_dice,n,left)
+    return [b_dice for b_dice in valid_ans if b_dice in left]
+
+def min_unary(w_dice,b_dice,max_unary=6,db_name=None):
+    '''
+    Fewest unary ops (! or ?) needed to solve a configuration
     Input:
     w_dice: 5-tuple of int. white dice combination
     b_dice: int. black dice total
-    db_name: str. name of solution db directory
     max_unary: int. max allowed number of unary ops (! or ?)
-    Output: list of int. unsolvable black dice configs for given white dice config
+    db_name: str. if given, read from this db's solvability index (see md_db.solvability),
+        else found with the value tables
+    Output: int or None. None if unsolvable with max_unary
+    '''
+    if db_name:
+        masks = db.solvability(db_name).get(_w_str(sorted(w_dice)),())[:max_unary+1]
+        return next((n for n,m in enumerate(masks) if m >> db.total_bit(b_dice) & 1),None)
+    return next((n for n in range(max_unary+1) if dp_totals(w_dice,n,{b_dice})),None)
+
+def _unsolved(masks,max_unary):
+    '''
+    Totals missing from a combo's solvability bitsets
+    Input:
+    masks: tuple of int. bitsets of totals solved per unary count (see md_db.solvability)
+    max_unary: int. max allowed number of unary ops (! or ?)
+    Output: list of int. unsolved black dice totals
     '''
-    s_dir = lambda b: os.path.join(db_name,''.join([str(w) for w in w_dice]),str(b))
-    w = tuple(sorted(w_dice))
-    return [b_dice for b_dice in valid_ans if not\
-            any(os.path.isfile(os.path.join(s_dir(b_dice),f'u{n}.p'))\
-            for n in range(max_unary+1))]
+    solved = 0
+    for m in masks[:max_unary+1]:
+        solved |= m
+    return [b_dice for b_dice in valid_ans if not solved >> db.total_bit(b_dice) & 1]
 
-def get_all_unsolvable(db_name,max_unary=10):
+def get_all_unsolvable(db_name=None,max_unary=6):
     '''
-    List all unsolvable combinations of white and black dice from dbs
+    List all unsolvable combinations of white and black dice
     Skips combos with no unsolvable
     Input:
-    db_name: str. name of solution db directory
+    db_name: str. if given, answer from this db's solvability index (see unsolvable)
     max_unary: int. max allowed number of unary ops (! or ?)
     Output: dict. (white_dice):[unsolvable black dice]
     '''
     lm = _list_missing_sols(db_name,max_unary)
-    return {tuple(map(int,w_dice)):lm[w_dice] for w_dice in lm if lm[w_dice]}
+    return {w_dice:lm[w_dice] for w_dice in lm if lm[w_dice]}
 
-def _list_missing_sols(db_name,max_unary=10):
+def _list_missing_sols(db_name=None,max_unary=6):
     '''
     Helper function for get_all_unsolvable: Includes empty lists where no sols missing
     Input:
-    db_name: str. name of solution db directory
+    db_name: str. if given, answer from this db's solvability index (see unsolvable)
     max_unary: int. max allowed number of unary ops (! or ?)
     Output: dict. (white_dice):[unsolvable black dice]
     '''
-    return {w_dice:unsolvable(tuple(map(int,w_dice)),db_name,max_unary)\
-            for w_dice in os.listdir(db_name)}
+    if db_name:
+        index = db.solvability(db_name)
+        return {w_dice:_unsolved(index.get(_w_str(w_dice),()),max_unary)\
+                for w_dice in it.combinations_with_replacement(range(1,7),5)}
+    return {w_dice:unsolvable(w_dice,None,max_unary)\
+            for w_dice in it.combinations_with_replacement(range(1,7),5)}
 
-def has_unsolvable(db_name,max_unary=10):
+def has_unsolvable(db_name=None,max_unary=6):
     '''
     List all white dice combinations that have unsolvable black dice with given max_unary
     Input:
-    db_name: str. name of solution db directory
+    db_name: str. if given, answer from this db's solvability index (see unsolvable)
     max_unary: int. max allowed number of unary ops (! or ?)
     Output: list of tuples. white dice combos with some unsolvable black dice
     '''
@@ -232,7 +1308,21 @@ def has_unsolvable(db_name,max_unary=10):
 # Main
 
 if __name__ == '__main__':
-    ws = None
-    for i in range(7):
-        make_sols_db('new_sols',ws,i,True)
-        ws = get_all_unsolvable('new_sols')
+    # Benchmark: float vs exact evaluation over the full expression space
+    # python3 md_solver.py bench [white dice] [n_unary], e.g. bench 12346 1
+    if sys.argv[1:2] == ['bench']:
+        w_dice = tuple(int(d) for d in (sys.argv[2] if len(sys.argv) > 2 else '12346'))
+        n_unary = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+        res = {}
+        for exact in [False,True]:
+            stats = Counter()
+            t = time.perf_counter()
+            res[exact] = {(e,_int_result(v)) for e,v in gen_valid_values(w_dice,n_unary,None,stats,\
+                    exact=exact) if _int_result(v) in valid_ans}
+            t = time.perf_counter()-t
+            print(f'{"exact" if exact else "float":6} {t:8.2f}s '
+                    f'{1e6*t/stats["nodes"]:6.2f}us/node | {_fmt_stats(stats)}')
+        print(f'solutions only float finds: {len(res[False]-res[True])}, '
+                f'only exact: {len(res[True]-res[False])}')
+        exit()
+    make_sols_levels('new_sols',range(7),verbose=True)
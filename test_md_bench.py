@@ -0,0 +1,19 @@
+import json
+import md_bench as mb
+
+def test_run_and_compare(monkeypatch):
+    monkeypatch.setattr(mb,'enum_configs',[((1,2,3),1)])
+    monkeypatch.setattr(mb,'enum_limit',2000)
+    monkeypatch.setattr(mb,'gen_configs',[((1,2,3),2)])
+    monkeypatch.setattr(mb,'humanize_config',((1,2,3),0))
+    monkeypatch.setattr(mb,'lookup_configs',[((1,1,1,1,6),66)])
+    monkeypatch.setattr(mb,'repeat',1)
+    out = json.loads(json.dumps(mb.run(quick=True)))
+    assert out['meta']['quick']
+    res = out['results']
+    assert res['enumerate/123u1']['count'] == 500
+    assert 'generate/123u1' in res and 'generate/123u2' not in res
+    assert res['get_sols_warm/store_11116_66']['count'] > 0
+    assert res['get_sols_cold/live_11116_66']['count'] == res['get_sols_cold/dir_11116_66']['count']
+    lines = mb.compare(out,out).splitlines()
+    assert len(lines) == len(res) and all([l.endswith('1.00x') for l in lines])
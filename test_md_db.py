@@ -0,0 +1,86 @@
+import os
+import pickle as pkl
+import tarfile
+import pytest
+from md_db import write_db, pack_db, get_sols, best_score, keys, solvability
+from md_db import header, record, MAGIC, VERSION
+from md_solver import _write_combo
+
+SOLS = {('11236',24,0):[('62*11+*',0),('36^11+/',2),('126*1+*',0)],('11236',24,1):[('3!11+2**',5)],
+        ('66666',11,0):[('66*6+6/6+',0)]}
+
+def test_write_db_round_trip(tmp_path):
+    path = str(tmp_path/'sols.mdb')
+    write_db(path,SOLS.items())
+    # Rows come back sorted by score within each unary count
+    assert get_sols((6,3,2,1,1),24,path) == [('62*11+*',0),('126*1+*',0),('36^11+/',2),\
+            ('3!11+2**',5)]
+    assert get_sols((6,6,6,6,6),11,path) == SOLS[('66666',11,0)]
+    assert get_sols((6,6,6,6,6),12,path) == []
+    assert keys(path) == sorted(SOLS)
+
+def test_get_sols_just_best(tmp_path):
+    path = str(tmp_path/'sols.mdb')
+    write_db(path,SOLS.items())
+    assert get_sols((1,1,2,3,6),24,path,just_best=True) == [('62*11+*',0),('126*1+*',0)]
+    assert best_score((1,1,2,3,6),24,path) == 0
+    assert best_score((1,1,2,3,6),25,path) is None
+
+def test_pack_db_from_dir_and_tarball(tmp_path):
+    for (w,b,n),sols in SOLS.items():
+        os.makedirs(tmp_path/'sols'/w/str(b),exist_ok=True)
+        with open(tmp_path/'sols'/w/str(b)/f'u{n}.p','wb') as out:
+            pkl.dump(sols,out)
+    with tarfile.open(tmp_path/'sols.tar.gz','w:gz') as tar:
+        tar.add(tmp_path/'sols',arcname='sols')
+    for src in ['sols','sols.tar.gz']:
+        path = str(tmp_path/f'{src}.mdb')
+        pack_db(str(tmp_path/src),path)
+        assert keys(path) == sorted(SOLS)
+        assert get_sols((1,1,2,3,6),24,path)[-1] == ('3!11+2**',5)
+
+def test_humanize_db(tmp_path):
+    from md_db import humanize_db, get_humanized
+    from md_humanizer import humanize
+    path = str(tmp_path/'sols.mdb')
+    write_db(path,SOLS.items())
+    assert get_humanized((1,1,2,3,6),24,path) is None
+    humanize_db(path)
+    full = humanize(get_sols((1,1,2,3,6),24,path))
+    assert get_humanized((6,3,2,1,1),24,path) == full
+    assert get_humanized((1,1,2,3,6),24,path,just_best=True) == [g for g in full if g[0][1] == 0]
+    assert get_humanized((1,1,2,3,6),25,path) == []
+    # Solutions are unchanged by the rewrite
+    assert keys(path) == sorted(SOLS)
+    assert get_sols((6,6,6,6,6),11,path) == SOLS[('66666',11,0)]
+
+def test_empty_entries(tmp_path):
+    path = str(tmp_path/'sols.mdb')
+    write_db(path,[(('11236',24,0),[]),(('11236',24,1),SOLS[('11236',24,1)])])
+    assert keys(path) == [('11236',24,1)]
+    assert get_sols((1,1,2,3,6),24,path,just_best=True) == SOLS[('11236',24,1)]
+    assert best_score((1,1,2,3,6),24,path) == 5
+    # An empty record written by an older version is ignored
+    old = str(tmp_path/'old.mdb')
+    with open(old,'wb') as f:
+        f.write(header.pack(MAGIC,VERSION,1,header.size,0,header.size+record.size)+\
+                record.pack(b'11236',24,0,header.size,0,0))
+    assert get_sols((1,1,2,3,6),24,old,just_best=True) == [] and keys(old) == []
+    assert best_score((1,1,2,3,6),24,old) is None and solvability(old) == {}
+
+def test_solvability(tmp_path,monkeypatch):
+    for (w,b,n),sols in SOLS.items():
+        os.makedirs(tmp_path/'sols'/w/str(b),exist_ok=True)
+        with open(tmp_path/'sols'/w/str(b)/f'u{n}.p','wb') as out:
+            pkl.dump(sols,out)
+    pack_db(str(tmp_path/'sols'),str(tmp_path/'sols.mdb'),False)
+    # 24 is the 10th total (11-16, 21-24), 11 the 1st
+    expected = {'11236':(1 << 9,1 << 9),'66666':(1,)}
+    assert solvability(str(tmp_path/'sols')) == expected
+    assert solvability(str(tmp_path/'sols.mdb')) == expected
+    # A level written later is seen
+    _write_combo(str(tmp_path/'sols'),(1,1,2,3,6),2,{25:[('3!11+2*+',5)]})
+    assert solvability(str(tmp_path/'sols'))['11236'] == (1 << 9,1 << 9,1 << 10)
+    # Unchanged, the directory isn't listed again
+    monkeypatch.setattr(os,'scandir',None)
+    assert solvability(str(tmp_path/'sols'))['66666'] == (1,)
@@ -0,0 +1,44 @@
+import os
+import random
+import pickle as pkl
+import itertools as it
+from md_db import write_db, humanize_db
+from md_difficulty import build_index, load_index, index_path, sample, roll_weight, _alias
+
+SOLS = {('11236',24,0):[('62*11+*',0),('36^11+/',2),('126*1+*',0)],('11236',25,1):[('3!11+2*+',5)]}
+
+def test_alias():
+    weights = [1,5,0,2,8,3]
+    prob, alias = _alias(weights)
+    dist = [0]*len(weights)
+    for i,(p,a) in enumerate(zip(prob,alias)):
+        dist[i] += p/len(weights)
+        dist[a] += (1-p)/len(weights)
+    assert all([abs(d-w/sum(weights)) < 1e-12 for d,w in zip(dist,weights)])
+
+def test_roll_weight():
+    assert roll_weight((1,1,2,3,6)) == 60 and roll_weight((6,6,6,6,6)) == 1
+    assert sum([roll_weight(w) for w in it.combinations_with_replacement(range(1,7),5)]) == 6**5
+
+def test_index_and_sample(tmp_path):
+    db = str(tmp_path/'sols.mdb')
+    write_db(db,SOLS.items())
+    humanize_db(db)
+    build_index(db)
+    idx = load_index(index_path(db))
+    assert idx['stats'][((1,1,2,3,6),24)] == (0,3,0)
+    assert idx['stats'][((1,1,2,3,6),25)] == (5,1,1)
+    assert idx['stats'][((1,1,1,1,1),51)] == (None,0,None)
+    assert [len(idx['bands'][b][0]) for b in ['easy','medium','hard','expert','any']] == [0,1,1,0,2]
+    rng = random.Random(0)
+    assert {sample(idx,'hard',rng) for i in range(20)} == {((1,1,2,3,6),25)}
+    assert {sample(idx,None,rng) for i in range(50)} == {((1,1,2,3,6),24),((1,1,2,3,6),25)}
+
+def test_index_from_legacy_dir(tmp_path):
+    for (w,b,n),sols in SOLS.items():
+        os.makedirs(tmp_path/'sols'/w/str(b),exist_ok=True)
+        with open(tmp_path/'sols'/w/str(b)/f'u{n}.p','wb') as out:
+            pkl.dump(sols,out)
+    store = str(tmp_path/'sols.mdb')
+    write_db(store,SOLS.items())
+    assert build_index(str(tmp_path/'sols'))['stats'] == build_index(store)['stats']
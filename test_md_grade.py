@@ -0,0 +1,26 @@
+import json
+from md_db import write_db, humanize_db
+from md_grade import grade_file, read_rows
+
+SOLS = {('11236',24,0):[('62*11+*',0),('36^11+/',2),('126*1+*',0)],('11236',24,1):[('3!11+2**',5)]}
+ROWS = ['player,white,black,solution','a,11236,24,(3-1)*6*2*1','b,61213,24,6*2^(3-1)*1',\
+        'c,11236,24,6*4','d,1 1 2 3 6,24,(6-2','e,123,24,1+2+3','f,11236,24,6*(1+3)/(2-1)']
+
+def test_grade_file(tmp_path):
+    db, src = str(tmp_path/'sols.mdb'), tmp_path/'in.csv'
+    write_db(db,SOLS.items())
+    humanize_db(db)
+    src.write_text('\n'.join(ROWS)+'\n')
+    res = grade_file(str(src),str(tmp_path/'out.jsonl'),db)
+    assert (res['rows'],res['correct'],res['optimal'],res['errors']) == (6,3,2,2)
+    out = [json.loads(l) for l in open(tmp_path/'out.jsonl')]
+    assert [g['player'] for g in out] == list('abcdef')
+    assert out[0]['optimal'] and out[0]['normalized'] == '1*2*6*(3-1)' and out[0]['best_score'] == 0
+    assert out[1]['correct'] and out[1]['score'] == 2 and not out[1]['optimal']
+    assert out[2]['wrong_dice'] and out[2]['value'] == 24 and not out[2]['correct']
+    assert out[3]['error'] == 'unbalanced parends' and out[4]['error'].startswith('Bad Row')
+    # JSON lines in, CSV out, in worker processes
+    rows = [{'w_dice':[1,1,2,3,6],'b_dice':24,'solution':r.split(',')[3]} for r in ROWS[1:4]]
+    src.write_text(''.join([json.dumps(r)+'\n' for r in rows]))
+    assert grade_file(str(src),str(tmp_path/'out.csv'),db,jobs=2)['correct'] == 2
+    assert [r['optimal'] for r in read_rows(str(tmp_path/'out.csv'))] == ['True','False','False']
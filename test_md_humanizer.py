@@ -18,11 +18,11 @@ def test_to_tree_nested_expression():
 def test_to_tree_expression_with_operators_and_parentheses():
     assert to_tree('7*(6+3+(3!))') == ['7', '*', ['6', '+', '3', '+', ['3', '!']]]
 
-# def test_to_expr_single_number():
-#     assert to_expr(to_tree('1')) == '1'
+def test_to_expr_single_number():
+    assert to_expr(to_tree('1')) == '1'
 
-# def test_to_expr_single_operator():
-#     assert to_expr(to_tree('+')) == '+'
+def test_to_expr_single_operator():
+    assert to_expr(to_tree('+')) == '+'
 
 def test_to_expr_simple_expression():
     assert to_expr(to_tree('1+2')) == '1+2'
@@ -33,6 +33,12 @@ def test_to_expr_nested_expression():
 def test_to_expr_nested_expression_smart_mode():
     assert to_expr(to_tree('1+(2*3)'), mode='smart') == '1+2*3'
 
+def test_to_expr_modes():
+    tree = to_tree('(6*(5+3+(3!)))-((2-1)-4)')
+    assert to_expr(tree) == '6*(5+3+3!)-(2-1-4)'
+    assert to_expr(tree, mode='normal') == '(6*(5+3+(3!)))-((2-1)-4)'
+    assert to_expr(to_tree('(2^3)^(4/(5/6))'), mode='full') == '((2)^(3))^((4)/((5)/(6)))'
+
 def test_sort_commute_single_symbol():
     # Test case: Single symbol
     tree = 'a'
@@ -58,7 +64,8 @@ def test_sort_commute_double_nested():
     assert sort_commute(tree) == expected
 
     import pytest
-from md_humanizer import normalize
+from md_humanizer import normalize, normalize_str
+from md_solver import gen_valid_exprs
 
 def test_normalize_and_shunt_1():
     input_expr = '(1+1)?!??/((1+1)?!+1)'
@@ -84,3 +91,6 @@ def test_normalize_and_shunt_4():
     output = normalize(shunt(input_expr))
     assert output == expected_output
 
+def test_normalize_matches_string_normalizer():
+    for expr in gen_valid_exprs((1,2,3),1):
+        assert normalize(expr) == normalize_str(expr)
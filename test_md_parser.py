@@ -1,5 +1,8 @@
 import pytest
-from md_parser import score, eval_infix
+from fractions import Fraction
+from md_parser import score, eval_infix, to_infix, node, to_node, node_score
+from md_parser import stack_calc, exact_func, evaluate_many, to_codes
+from md_parser import parenthesize, parenthesize_multi, outside_parends
 
 def test_score_empty_expression():
     assert score('') == 0
@@ -37,3 +40,50 @@ def test_eval_infix_with_paren():
 
 def test_eval_infix_mix():
     assert eval_infix('5+4-3?') == 3
+
+def test_to_infix_modes():
+    assert to_infix('123-4-+5/') == '(1+2-3-4)/5'
+    assert to_infix('1234--+') == '1+2-(3-4)'
+    assert to_infix('12+3+4!+','normal') == '1+2+3+(4!)'
+    assert to_infix('34!!^','full') == '((3)^(((4)!)!))'
+
+def test_parenthesize():
+    assert outside_parends('2*(3+(4-1))!') == ['2','*','!']
+    assert parenthesize(['1+2','(3-4)!'],'*') == ['(1+2)','(3-4)!']
+    assert parenthesize(['2^3','4^5'],'^') == ['(2^3)','4^5']
+    assert parenthesize(['1-2','3+4'],'-') == ['1-2','(3+4)']
+    assert parenthesize(['1+(2*3)','3!'],'+','normal') == ['1+(2*3)','(3!)']
+    assert parenthesize_multi(['1+2','3*4','5'],'*') == ['(1+2)','3*4','5']
+
+def test_nodes_are_shared():
+    a, b = to_node('34!*5+'), to_node('4!5*')
+    assert a[1][0][1][1] is b[1][0]
+    assert a is to_node(list('34!*5+'))
+    assert node_score(a) == 5
+    assert node('+',node('1'),node('2')) == ('+',(('1',()),('2',())))
+
+def test_stack_calc_exact():
+    assert stack_calc('115/2^/',exact=True) == 25
+    with pytest.raises(AssertionError):
+        stack_calc('115/2^/')
+    assert stack_calc('66^6^',exact=True) == 6**36
+    with pytest.raises(AssertionError):
+        stack_calc('12/',exact=True)
+
+def test_exact_func():
+    assert exact_func['/'](6,3) == 2 and type(exact_func['/'](6,3)) is int
+    assert exact_func['/'](1,3) == Fraction(1,3)
+    assert exact_func['^'](Fraction(4,9),Fraction(-1,2)) == Fraction(3,2)
+    assert exact_func['^'](1,4**6) == 1
+    for t,args,err in [('^',(2,Fraction(1,2)),ValueError),('^',(6,6**6),OverflowError),\
+            ('?',(Fraction(1,2),),ZeroDivisionError),('!',(10,),KeyError)]:
+        with pytest.raises(err):
+            exact_func[t](*args)
+
+def test_evaluate_many():
+    exprs = ['12+3*','211-/','4!!','3?1+','12/','36^','1+','12','666^^','12/3*']
+    values,errors = evaluate_many([to_codes(e) for e in exprs])
+    assert values == [9,None,None,7,None,729,None,None,None,None]
+    assert errors == [0,2,4,0,7,0,1,1,5,7]
+    assert evaluate_many([to_codes('12/3*'),to_codes('12/?')],exact=True) == ([None,None],[7,3])
+    assert evaluate_many([to_codes('12/6*')],exact=True) == ([3],[0])
@@ -0,0 +1,20 @@
+import md_profile as prof
+import md_parser as mp
+import md_solver as ms
+
+def test_run_counts_and_restores():
+    score,plus = mp.score,mp.op_func['+']
+    sols = prof.run(ms.gen_valid_solutions,(1,1,1,2,6),[24])
+    n = sum(map(len,sols.values()))
+    assert not prof.enabled and mp.score is score and mp.op_func['+'] is plus
+    assert prof.counters['solutions kept'] == n == prof.calls['score']
+    assert prof.counters['nodes'] > prof.counters['evaluated'] >= n
+    assert prof.counters['raised ZeroDivisionError'] >= prof.counters['zero division'] > 0
+    assert prof.calls['search'] == 1 and prof.seconds['search'] >= prof.seconds['score']
+    assert 'solutions kept' in prof.report(1.0)
+
+def test_off_by_default():
+    prof.reset()
+    with prof.stage('write'):
+        ms.gen_valid_solutions((1,1,1,1,6),[66])
+    assert not prof.seconds and not prof.counters
@@ -0,0 +1,65 @@
+import os
+import sys
+import json
+import time
+import subprocess
+import pytest
+from md_db import write_db, humanize_db
+from md_server import query, _connect, _fast
+
+SOLS = {('11236',24,0):[('62*11+*',0),('36^11+/',2),('126*1+*',0)],('11236',24,1):[('3!11+2**',5)]}
+
+@pytest.fixture
+def service(tmp_path):
+    path, address = str(tmp_path/'sols.mdb'), str(tmp_path/'md.sock')
+    write_db(path,SOLS.items())
+    humanize_db(path)
+    proc = subprocess.Popen([sys.executable,'-c',\
+            f'import md_server; md_server.serve({address!r},{path!r},1)'],\
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+    # The socket file appears before the server listens: wait for an answer
+    deadline = time.monotonic()+30
+    while True:
+        assert proc.poll() is None, f'service exited with {proc.returncode}'
+        try:
+            assert query(address,op='ping') == 'pong'
+            break
+        except OSError:
+            assert time.monotonic() < deadline, 'service not answering'
+            time.sleep(0.05)
+    yield address
+    proc.terminate()
+    proc.wait()
+    assert not os.path.exists(address)
+
+def test_queries(service):
+    assert query(service,op='ping') == 'pong'
+    best = query(service,op='solve',w_dice=11236,b_dice=24,just_best=True)
+    assert [s for (e,s),l in best] == [0,0]
+    res = query(service,op='analyze',w_dice=[3,1,2,6,1],b_dice=24,solution='(3-1)*6*2*1')
+    assert res['correct'] and res['optimal'] and res['score'] == 0
+    # Well-formed but invalid answers are graded, not errors
+    for sol in ['3/(1-1)+6+2','6!!*1*1*2*3']:
+        res = query(service,op='analyze',w_dice=11236,b_dice=24,solution=sol)
+        assert res['value'] is None and not res['correct'] and res['error']
+    assert len(query(service,op='unsolvable',w_dice=11236)) == 35
+    with pytest.raises(RuntimeError,match='KeyError'):
+        query(service,op='solve',w_dice=11236)
+
+def test_pipelined_requests(service):
+    with _connect(service) as sock:
+        reqs = [{'id':i,'op':'min_unary','w_dice':11236,'b_dice':b} for i,b in enumerate([24,25])]
+        sock.sendall(''.join([json.dumps(r)+'\n' for r in reqs]).encode()+b'not json\n')
+        f = sock.makefile('rb')
+        resps = {r['id']:r for r in [json.loads(f.readline()) for _ in range(3)]}
+    assert resps[0]['result'] == 0 and resps[1]['result'] is None
+    assert not resps[None]['ok']
+
+def test_fast_requests(tmp_path):
+    path = str(tmp_path/'sols.mdb')
+    write_db(path,SOLS.items())
+    assert _fast(path,{'op':'min_unary'}) and not _fast(path,{'op':'solve','just_best':True})
+    humanize_db(path)
+    assert _fast(path,{'op':'solve','just_best':True}) and _fast(path,{'op':'analyze'})
+    # Full solves send every solution: left to the workers
+    assert not _fast(path,{'op':'solve'}) and not _fast(str(tmp_path/'none'),{'op':'unsolvable'})
@@ -0,0 +1,173 @@
+import os
+import pytest
+from collections import Counter
+from md_solver import gen_valid_exprs, gen_valid_values, gen_valid_solutions
+from md_solver import dp_solutions, dp_solution, dp_totals, dp_levels, unsolvable, min_unary
+from md_solver import make_sols_db, make_sols_levels, get_sols, vector_solutions, best_solutions
+from md_parser import evaluate
+
+def test_gen_valid_values_matches_evaluate():
+    for expr,value in gen_valid_values((1,2,6),1):
+        assert evaluate(expr,mode='postfix') == value or value != int(value)
+
+def test_gen_valid_values_drops_bad_operations():
+    exprs = [e for e,v in gen_valid_values((1,1,2),0)]
+    assert '211-/' not in exprs
+    assert '211-/' in gen_valid_exprs((1,1,2),0)
+
+def test_gen_valid_solutions_single_total():
+    sols = gen_valid_solutions((1,2,3,4,5),[15],0)
+    assert list(sols) == [15]
+    assert ('12+3+4+5+',0) in sols[15]
+
+def test_gen_valid_values_prune_counts():
+    stats = Counter()
+    values = [v for e,v in gen_valid_values((1,1,1,1,1),1,{51},stats)]
+    assert values == []
+    assert stats['zero division'] > 0 and stats['off target'] > 0
+    assert stats['evaluated'] == 0
+
+def test_canonical_is_exact():
+    # Every total the full exact search reaches, one spelling per reordering
+    full = gen_valid_solutions((1,2,2,6),None,1,exact=True)
+    canon = gen_valid_solutions((1,2,2,6),None,1,canonical=True)
+    assert set(canon) == set(full)
+    assert all([set(canon[b]) <= set(full[b]) for b in canon])
+
+def test_gen_valid_exprs_canonical_commute():
+    exprs = list(gen_valid_exprs((1,2,3),0,canonical=True))
+    assert '12+3+' in exprs
+    assert '21+3+' not in exprs and '123++' not in exprs and '312++' not in exprs
+    assert '312-+' in exprs and '321-+' in exprs and '12-3+' not in exprs
+
+def test_gen_valid_solutions_exact():
+    # 1/(1/5)^2 is 24.999999999999996 in floats
+    assert ('115/2^/',2) in gen_valid_solutions((1,1,2,5),[25],0,exact=True)[25]
+    assert ('115/2^/',2) not in gen_valid_solutions((1,1,2,5),[25],0).get(25,[])
+
+def test_vector_solutions_match_search():
+    pytest.importorskip('numpy')
+    ws = [(1,2,2,6),(1,1,2,5)]
+    sols = vector_solutions(ws,1)
+    for w in ws:
+        search = gen_valid_solutions(w,None,1)
+        assert {b:sorted(v) for b,v in sols[w].items()} == {b:sorted(v) for b,v in search.items()}
+
+def test_best_solutions():
+    sols = {b:[] for b in [11,24,56]}
+    for n in [0,1]:
+        for b,v in gen_valid_solutions((1,2,6),[11,24,56],n).items():
+            sols[b] += v
+    for b,v in sols.items():
+        best = min([sc for e,sc in v])
+        assert sorted(best_solutions((1,2,6),b,1)) == sorted([x for x in v if x[1] == best])
+        top = best_solutions((1,2,6),b,1,k=20)
+        assert [sc for e,sc in top] == sorted([sc for e,sc in v])[:20]
+        assert set(top) <= set(v)
+    assert best_solutions((1,1,1),66,1) == []
+    assert best_solutions((1,1,1,1,1),51) == []
+    # Fewest unaries only, as a db in unsolved mode: 66 needs one with these dice
+    level = dp_solutions((1,2,6),66,1)
+    assert sorted(best_solutions((1,2,6),66,fewest=True)) ==\
+            sorted([x for x in level if x[1] == min([sc for e,sc in level])])
+
+def test_dp_solutions_match_search():
+    sols = gen_valid_solutions((1,2,2,6),[11,24],1,exact=True)
+    for b in [11,24]:
+        assert sorted(dp_solutions((1,2,2,6),b,1)) == sorted(sols[b])
+
+def test_dp_solution_evaluates_to_total():
+    assert evaluate(dp_solution((3,4,5,6,6),42,0),mode='postfix') == 42
+    assert dp_solution((1,1,1,1,1),51,1) is None
+
+def test_unsolvable():
+    assert dp_totals((1,1,1,1,1),0,{5,51}) == {5}
+    assert unsolvable((1,1,1,1,1),None,6) == [51]
+    assert unsolvable((1,2,3,4,5),None,0) == []
+
+def test_unsolvable_from_db(tmp_path):
+    from md_solver import valid_ans
+    path, w = str(tmp_path/'sols'), (1,1,1,1,1)
+    for n in [0,1,2]:
+        make_sols_db(path,{w:[11,25,51]},n,exact=True)
+    # Totals the db has no solutions for are unsolvable
+    assert unsolvable(w,path,2) ==\
+            [b for b in valid_ans if b not in [11,25,51] or b in unsolvable(w,None,2)]
+    for b in [11,25,51]:
+        assert min_unary(w,b,2,path) == min_unary(w,b,2)
+    assert min_unary(w,11) == 1 and min_unary(w,51) is None
+
+def test_make_sols_db_resumes(tmp_path,monkeypatch):
+    import md_solver
+    db = str(tmp_path/'sols')
+    make_sols_db(db,{(1,1,1,1,6):[11,13]},0)
+    assert ('111+61-*+',0) in get_sols((1,1,1,1,6),11,db)
+    assert sorted(os.listdir(os.path.join(db,'11116'))) == ['.u0.done','11','13']
+    # Finished combos are not solved again
+    monkeypatch.setattr(md_solver,'gen_valid_solutions',None)
+    make_sols_db(db,{(1,1,1,1,6):[11,13]},0)
+
+def test_make_sols_db_streaming(tmp_path):
+    plain, streamed = str(tmp_path/'plain'), str(tmp_path/'streamed')
+    make_sols_db(plain,{(1,1,2,5,6):None},0)
+    make_sols_db(streamed,{(1,1,2,5,6):None},0,buffer=100)
+    assert sorted(os.listdir(os.path.join(streamed,'11256'))) ==\
+            sorted(os.listdir(os.path.join(plain,'11256')))
+    for b in [11,24,66]:
+        assert sorted(get_sols((1,1,2,5,6),b,streamed)) == sorted(get_sols((1,1,2,5,6),b,plain))
+
+def test_progress_log(tmp_path,monkeypatch):
+    import json, md_solver
+    log = str(tmp_path/'progress.jsonl')
+    monkeypatch.setattr(md_solver,'progress_interval',0)
+    monkeypatch.setattr(md_solver,'progress_check',1)
+    stats = Counter()
+    sols = gen_valid_solutions((1,2,2,6),None,1,stats=stats,log=log)
+    records = [json.loads(l) for l in open(log)]
+    assert len(records) == stats['nodes']+1
+    assert [r['done'] for r in records] == sorted(r['done'] for r in records)
+    assert records[-1]['done'] == 1 and records[-1]['eta'] == 0
+    assert records[-1]['sols'] == sum(map(len,sols.values()))
+    assert records[-1]['totals'] == len(sols)
+    # Reported while searching, even with no solutions
+    open(log,'w').close()
+    assert gen_valid_solutions((1,1,1,1,1),[51],0,log=log) == {}
+    assert len(open(log).readlines()) > 1
+
+def test_dp_levels_match_search():
+    for n,vs in dp_levels((1,2,2,6),[0,2]):
+        assert {b:sorted(v) for b,v in vs.items()} ==\
+                {b:sorted(v) for b,v in gen_valid_solutions((1,2,2,6),None,n,exact=True).items()}
+    # Unsolved mode: only totals no lower level reached (5 is 1+1+1+1+1)
+    assert [(n,sorted(vs)) for n,vs in dp_levels((1,1,1,1,1),[1],[5,51])] == [(1,[5])]
+    assert [(n,sorted(vs)) for n,vs in dp_levels((1,1,1,1,1),[1],[5,51],True)] == [(1,[])]
+
+def test_make_sols_levels(tmp_path):
+    by_level, incremental = str(tmp_path/'by_level'), str(tmp_path/'incremental')
+    for n in [0,1]:
+        make_sols_db(by_level,{(1,1,1,1,6):[11,13,64]},n,exact=True)
+    make_sols_levels(incremental,[0,1],{(1,1,1,1,6):[11,13,64]},unsolved=False)
+    for b in [11,13,64]:
+        assert sorted(get_sols((1,1,1,1,6),b,incremental)) ==\
+                sorted(get_sols((1,1,1,1,6),b,by_level))
+    assert sorted(os.listdir(os.path.join(incremental,'11116'))) ==\
+            sorted(os.listdir(os.path.join(by_level,'11116')))
+
+def test_live_sols(tmp_path,monkeypatch):
+    import md_solver
+    cache = str(tmp_path/'cache')
+    monkeypatch.setattr(md_solver,'live_dir',cache)
+    # 24 = 4*6 needs no unaries; 66 needs at least one with these dice
+    sols = get_sols((1,4,6),24,str(tmp_path/'no_db'))
+    assert sorted(sols) == sorted(gen_valid_solutions((1,4,6),[24],0,exact=True)[24])
+    assert os.listdir(os.path.join(cache,'146','24')) == ['u0.p']
+    best = get_sols((1,4,6),66,str(tmp_path/'no_db'),just_best=True)
+    level = dp_solutions((1,4,6),66,min_unary((1,4,6),66))
+    assert sorted(best) == sorted([x for x in level if x[1] == min([sc for e,sc in level])])
+    # Saved results are read back instead of solved again
+    monkeypatch.setattr(md_solver,'_dp_level',None)
+    monkeypatch.setattr(md_solver,'best_solutions',None)
+    md_solver._live.cache_clear()
+    assert sorted(get_sols((1,4,6),24,str(tmp_path/'no_db'))) == sorted(sols)
+    assert sorted(get_sols((1,4,6),24,str(tmp_path/'no_db'),just_best=True)) ==\
+            sorted([x for x in sols if x[1] == min([sc for e,sc in sols])])